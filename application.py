@@ -1,9 +1,22 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import nodes
+from jinja2.ext import Extension
 import sqlite3
 import os
 import time
+import csv
+import io
+import json
+import re
+import uuid
+import tempfile
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from threading import Lock
+from threading import Lock, Thread, local, BoundedSemaphore
+from contextlib import contextmanager
 import pytz
 
 app = Flask(__name__)
@@ -14,8 +27,113 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads', 'equipment')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-MAIN_DB = os.path.join(BASE_DIR, 'schooltech.db')
-db_lock = Lock()
+MAIN_DB = os.environ.get('SCHOOLTECH_DB', os.path.join(BASE_DIR, 'schooltech.db'))
+DB_BUSY_TIMEOUT = float(os.environ.get('SCHOOLTECH_DB_BUSY_TIMEOUT', 30))
+WAL_CHECKPOINT_INTERVAL = int(os.environ.get('SCHOOLTECH_WAL_CHECKPOINT_INTERVAL', 300))
+WAL_SIZE_LIMIT = int(os.environ.get('SCHOOLTECH_WAL_SIZE_LIMIT', 64 * 1024 * 1024))
+SHARDED_MODE = os.environ.get('SCHOOLTECH_SHARDED', '0') == '1'
+SHARDS_DIR = os.environ.get('SCHOOLTECH_SHARDS_DIR', os.path.join(BASE_DIR, 'shards'))
+initialized_shards = set()
+initialized_shards_lock = Lock()
+school_shard_ids = {}
+SCHOOL_NUMBER_PATTERN = re.compile(r'[0-9A-ZА-ЯЁ]+(-[0-9A-ZА-ЯЁ]+)*')
+SCHOOL_NUMBER_MAX_LENGTH = 20
+DATABASE_ID_VERSION_NAME = 'database'
+DATABASE_ID_RANGE = 2 ** 53 - 1
+unit_of_work_state = local()
+WRITE_QUEUE_ENABLED = os.environ.get('SCHOOLTECH_WRITE_QUEUE', '0') == '1'
+WRITE_BATCH_MAX = int(os.environ.get('SCHOOLTECH_WRITE_BATCH_MAX', 200))
+WRITE_TIMEOUT = float(os.environ.get('SCHOOLTECH_WRITE_TIMEOUT', 30))
+write_queues = {}
+write_queues_lock = Lock()
+
+DASHBOARD_STATS_TTL = 30
+DASHBOARD_ACTIVITY_DAYS = 14
+DATABASES_PAGE_SIZE = 100
+dashboard_stats_cache = {'expires': 0, 'data': None}
+dashboard_stats_lock = Lock()
+
+FRAGMENT_CACHE_MAX_ENTRIES = 256
+fragment_cache = OrderedDict()
+fragment_cache_lock = Lock()
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_TABLES = {
+    'users': {
+        'query': '''SELECT id, username, first_name, last_name, middle_name, school_number, class, email, role, is_active, created_at
+                    FROM users''',
+        'school_column': 'school_number',
+        'date_column': 'created_at',
+        'order_column': 'id'
+    },
+    'equipment': {
+        'query': '''SELECT id, name, description, category, school_number, available, image_filename, created_by, created_at
+                    FROM equipment''',
+        'school_column': 'school_number',
+        'date_column': 'created_at',
+        'order_column': 'id',
+        'per_school': True
+    },
+    'requests': {
+        'query': '''SELECT r.id, r.student_id, u.username AS student_username, r.equipment_id, e.name AS equipment_name,
+                    e.school_number, r.status, r.due_date, r.request_date, r.approved_by
+                    FROM requests r
+                    LEFT JOIN users u ON r.student_id = u.id
+                    LEFT JOIN equipment e ON r.equipment_id = e.id''',
+        'school_column': 'e.school_number',
+        'date_column': 'r.request_date',
+        'order_column': 'r.id',
+        'per_school': True
+    },
+    'logs': {
+        'query': '''SELECT l.id, l.user_id, u.username, u.school_number, l.action, l.created_at
+                    FROM logs l
+                    LEFT JOIN users u ON l.user_id = u.id''',
+        'school_column': 'u.school_number',
+        'date_column': 'l.created_at',
+        'order_column': 'l.id'
+    }
+}
+
+# Лимиты переопределяются переменными окружения вида "/chat/send=1.0:10,POST /admin/import/=0.02:2"
+def load_limits(env_name, defaults, parse_limit):
+    limits = dict(defaults)
+    for item in os.environ.get(env_name, '').split(','):
+        if item.strip():
+            key, _, value = item.strip().rpartition('=')
+            limits[key] = parse_limit(value)
+    return limits
+
+RATE_LIMITS = load_limits('SCHOOLTECH_RATE_LIMITS', {
+    '/chat/send': (1.0, 10),
+    '/chat/channels/': (0.5, 5),
+    '/request_equipment': (0.2, 5),
+    '/update_request_status': (1.0, 20),
+    '/admin/send_notification': (0.05, 2),
+    'POST /admin/import/': (0.02, 2)
+}, lambda value: tuple(float(part) for part in value.split(':')))
+RATE_LIMIT_MAX_BUCKETS = 10000
+RATE_LIMIT_IDLE_SECONDS = 600
+rate_limit_buckets = {}
+rate_limit_lock = Lock()
+
+CONCURRENCY_LIMITS = load_limits('SCHOOLTECH_CONCURRENCY_LIMITS', {
+    '/admin/export/': 2,
+    '/admin/databases': 4,
+    'POST /admin/import/': 2
+}, int)
+concurrency_slots = {path: BoundedSemaphore(limit) for path, limit in CONCURRENCY_LIMITS.items()}
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_MAX_ERRORS = 200
+IMPORT_USER_ROLES = ('student',)
+
+ACTIVE_REQUEST_STATUSES = ('pending', 'approved')
+DEFAULT_LOAN_DAYS = 7
+CALENDAR_DEFAULT_DAYS = 14
+CALENDAR_MAX_DAYS = 62
+# Москва живет по UTC+3 без перехода на летнее время
+MOSCOW_UTC_OFFSET = '+3 hours'
 
 PRE_CREATED_ACCOUNTS = {
     'GOPTAR': {
@@ -78,40 +196,80 @@ def format_date_display(date_string):
     except:
         return str(date_string)
 
+def format_moscow_datetime_display(dt_string):
+    try:
+        return datetime.strptime(dt_string, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')
+    except:
+        return str(dt_string)[:16]
+
 def get_db_connection():
-    for attempt in range(5):
-        try:
-            with db_lock:
-                conn = sqlite3.connect(MAIN_DB, timeout=30.0)
-                conn.row_factory = sqlite3.Row
-                conn.execute("PRAGMA foreign_keys = ON")
-                conn.execute("PRAGMA journal_mode = WAL")
-                return conn
-        except sqlite3.OperationalError:
-            if attempt < 4:
-                time.sleep(0.1)
-                continue
-            raise
-    raise sqlite3.OperationalError("Не удалось подключиться к базе")
+    conn = sqlite3.connect(MAIN_DB, timeout=DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA journal_size_limit = {WAL_SIZE_LIMIT}")
+    return conn
 
-def init_database():
+def is_valid_school_number(school_number):
+    return (len(school_number) <= SCHOOL_NUMBER_MAX_LENGTH
+            and SCHOOL_NUMBER_PATTERN.fullmatch(school_number) is not None)
+
+def register_school(c, school_number):
+    c.execute("INSERT OR IGNORE INTO school_shards (school_number, created_at) VALUES (?, ?)",
+              (school_number, format_moscow_time()))
+
+# Файл школы называется по id из таблицы school_shards, а не по самому номеру,
+# поэтому номера вроде "1-А" и "1А" не попадают в один файл
+def school_shard_path(school_number):
+    school_number = str(school_number)
+    with initialized_shards_lock:
+        shard_id = school_shard_ids.get(school_number)
+    if shard_id is None:
+        conn = get_db_connection()
+        row = conn.execute("SELECT id FROM school_shards WHERE school_number = ?", (school_number,)).fetchone()
+        conn.close()
+        if row is None:
+            raise ValueError(f"Школа не зарегистрирована: {school_number!r}")
+        shard_id = row['id']
+        with initialized_shards_lock:
+            school_shard_ids[school_number] = shard_id
+    return os.path.join(SHARDS_DIR, f"school_{shard_id}.db")
+
+def is_registered_school(school_number):
     conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  first_name TEXT NOT NULL,
-                  last_name TEXT NOT NULL,
-                  middle_name TEXT,
-                  school_number TEXT NOT NULL,
-                  class TEXT NOT NULL,
-                  username TEXT UNIQUE NOT NULL,
-                  email TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  role TEXT NOT NULL DEFAULT 'student',
-                  is_active BOOLEAN DEFAULT 1,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
+    row = conn.execute("SELECT 1 FROM school_shards WHERE school_number = ?", (school_number,)).fetchone()
+    conn.close()
+    return row is not None
+
+def school_shard_numbers():
+    if not SHARDED_MODE:
+        return [None]
+    conn = get_db_connection()
+    numbers = [row['school_number'] for row in
+               conn.execute("SELECT school_number FROM school_shards ORDER BY school_number")]
+    conn.close()
+    return numbers
+
+def get_school_db_connection(school_number):
+    if not SHARDED_MODE or school_number is None:
+        return get_db_connection()
+    
+    path = school_shard_path(school_number)
+    with initialized_shards_lock:
+        if path not in initialized_shards:
+            init_school_database(path)
+            initialized_shards.add(path)
+    
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA journal_size_limit = {WAL_SIZE_LIMIT}")
+    conn.execute("ATTACH DATABASE ? AS central", (MAIN_DB,))
+    return conn
+
+def create_school_tables(c):
     c.execute('''CREATE TABLE IF NOT EXISTS equipment
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   name TEXT NOT NULL,
@@ -121,7 +279,11 @@ def init_database():
                   available INTEGER DEFAULT 1,
                   image_filename TEXT,
                   created_by INTEGER,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  quantity INTEGER,
+                  version INTEGER NOT NULL DEFAULT 0)''')
+    ensure_column(c, 'equipment', 'quantity', 'INTEGER')
+    ensure_column(c, 'equipment', 'version', 'INTEGER NOT NULL DEFAULT 0')
     
     c.execute('''CREATE TABLE IF NOT EXISTS requests
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -130,14 +292,182 @@ def init_database():
                   status TEXT DEFAULT 'pending',
                   due_date TEXT,
                   request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  approved_by INTEGER)''')
+                  approved_by INTEGER,
+                  version INTEGER NOT NULL DEFAULT 0,
+                  start_at TEXT,
+                  end_at TEXT,
+                  is_reservation BOOLEAN DEFAULT 0)''')
+    ensure_column(c, 'requests', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    ensure_column(c, 'requests', 'start_at', 'TEXT')
+    ensure_column(c, 'requests', 'end_at', 'TEXT')
+    ensure_column(c, 'requests', 'is_reservation', 'BOOLEAN DEFAULT 0')
+    
+    c.execute('''UPDATE equipment
+                 SET quantity = available + (SELECT COUNT(*) FROM requests r
+                                             WHERE r.equipment_id = equipment.id
+                                               AND r.status IN ('pending', 'approved'))
+                 WHERE quantity IS NULL''')
+    c.execute(f'''UPDATE requests
+                  SET start_at = datetime(request_date, '{MOSCOW_UTC_OFFSET}'),
+                      end_at = CASE WHEN due_date IS NOT NULL AND due_date != ''
+                                    THEN date(due_date, '+1 day') || ' 00:00:00'
+                                    ELSE datetime(request_date, '{MOSCOW_UTC_OFFSET}', '+{DEFAULT_LOAN_DAYS} days') END
+                  WHERE start_at IS NULL''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS change_versions
+                 (name TEXT PRIMARY KEY,
+                  version INTEGER NOT NULL DEFAULT 0)''')
+    c.execute("INSERT OR IGNORE INTO change_versions (name, version) VALUES ('requests', 0)")
+    c.execute("INSERT OR IGNORE INTO change_versions (name, version) VALUES ('equipment', 0)")
+    # Случайный номер файла базы: после переноса в файлы школ счетчики версий начинаются заново
+    c.execute(f'''INSERT OR IGNORE INTO change_versions (name, version)
+                  VALUES ('{DATABASE_ID_VERSION_NAME}', abs(random() % {DATABASE_ID_RANGE}) + 1)''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS request_tombstones
+                 (request_id INTEGER NOT NULL,
+                  school_number TEXT,
+                  version INTEGER NOT NULL)''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS equipment_tombstones
+                 (equipment_id INTEGER NOT NULL,
+                  school_number TEXT,
+                  version INTEGER NOT NULL)''')
+    
+    c.execute('''CREATE TRIGGER IF NOT EXISTS equipment_version_insert AFTER INSERT ON equipment
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'equipment';
+                     UPDATE equipment SET version = (SELECT version FROM change_versions WHERE name = 'equipment')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS equipment_version_update
+                 AFTER UPDATE OF name, description, category, available, quantity, image_filename ON equipment
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'equipment';
+                     UPDATE equipment SET version = (SELECT version FROM change_versions WHERE name = 'equipment')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS equipment_version_delete AFTER DELETE ON equipment
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'equipment';
+                     INSERT INTO equipment_tombstones (equipment_id, school_number, version)
+                     VALUES (OLD.id, OLD.school_number,
+                             (SELECT version FROM change_versions WHERE name = 'equipment'));
+                 END''')
+    
+    c.execute('''CREATE TRIGGER IF NOT EXISTS requests_version_insert AFTER INSERT ON requests
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'requests';
+                     UPDATE requests SET version = (SELECT version FROM change_versions WHERE name = 'requests')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS requests_version_update
+                 AFTER UPDATE OF student_id, equipment_id, status, due_date, approved_by, start_at, end_at ON requests
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'requests';
+                     UPDATE requests SET version = (SELECT version FROM change_versions WHERE name = 'requests')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS requests_version_delete AFTER DELETE ON requests
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'requests';
+                     INSERT INTO request_tombstones (request_id, school_number, version)
+                     VALUES (OLD.id,
+                             (SELECT school_number FROM equipment WHERE id = OLD.equipment_id),
+                             (SELECT version FROM change_versions WHERE name = 'requests'));
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS equipment_available_version AFTER UPDATE OF available ON equipment
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'requests';
+                     UPDATE requests SET version = (SELECT version FROM change_versions WHERE name = 'requests')
+                     WHERE equipment_id = NEW.id AND status != 'returned';
+                 END''')
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_equipment_school ON equipment (school_number)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_requests_status ON requests (status)")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS equipment_default_quantity AFTER INSERT ON equipment
+                 WHEN NEW.quantity IS NULL
+                 BEGIN
+                     UPDATE equipment SET quantity = NEW.available WHERE id = NEW.id;
+                 END''')
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_requests_version ON requests (version)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_equipment_version ON equipment (version)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_equipment_tombstones_version ON equipment_tombstones (version)")
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_requests_active_interval ON requests (equipment_id, end_at, start_at)
+                 WHERE status IN ('pending', 'approved')''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_request_tombstones_version ON request_tombstones (version)")
+
+def init_school_database(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    create_school_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def ensure_column(c, table, column, definition):
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def init_database():
+    conn = get_db_connection()
+    conn.execute("PRAGMA journal_mode = WAL")
+    c = conn.cursor()
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  first_name TEXT NOT NULL,
+                  last_name TEXT NOT NULL,
+                  middle_name TEXT,
+                  school_number TEXT NOT NULL,
+                  class TEXT NOT NULL,
+                  username TEXT UNIQUE NOT NULL,
+                  email TEXT UNIQUE NOT NULL,
+                  password TEXT NOT NULL,
+                  role TEXT NOT NULL DEFAULT 'student',
+                  is_active BOOLEAN DEFAULT 1,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  version INTEGER NOT NULL DEFAULT 0)''')
+    ensure_column(c, 'users', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    
+    create_school_tables(c)
+    
+    c.execute("INSERT OR IGNORE INTO change_versions (name, version) VALUES ('users', 0)")
+    c.execute('''CREATE TABLE IF NOT EXISTS user_tombstones
+                 (user_id INTEGER NOT NULL,
+                  version INTEGER NOT NULL)''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'users';
+                     UPDATE users SET version = (SELECT version FROM change_versions WHERE name = 'users')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS users_version_update
+                 AFTER UPDATE OF username, first_name, last_name, middle_name, role ON users
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'users';
+                     UPDATE users SET version = (SELECT version FROM change_versions WHERE name = 'users')
+                     WHERE id = NEW.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users
+                 BEGIN
+                     UPDATE change_versions SET version = version + 1 WHERE name = 'users';
+                     INSERT INTO user_tombstones (user_id, version)
+                     VALUES (OLD.id, (SELECT version FROM change_versions WHERE name = 'users'));
+                 END''')
     
     c.execute('''CREATE TABLE IF NOT EXISTS notifications
                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 message TEXT NOT NULL,
                 is_read BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sender_id INTEGER,
+                count INTEGER NOT NULL DEFAULT 1)''')
+    ensure_column(c, 'notifications', 'sender_id', 'INTEGER')
+    ensure_column(c, 'notifications', 'count', 'INTEGER NOT NULL DEFAULT 1')
     
     c.execute('''CREATE TABLE IF NOT EXISTS logs
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -153,6 +483,47 @@ def init_database():
                   is_read BOOLEAN DEFAULT 0,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
     
+    c.execute('''CREATE TABLE IF NOT EXISTS channels
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  school_number TEXT NOT NULL,
+                  class TEXT NOT NULL DEFAULT '',
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  UNIQUE (school_number, class))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS channel_messages
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  channel_id INTEGER NOT NULL,
+                  sender_id INTEGER NOT NULL,
+                  message TEXT NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (channel_id) REFERENCES channels (id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS channel_reads
+                 (channel_id INTEGER NOT NULL,
+                  user_id INTEGER NOT NULL,
+                  last_read_id INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (channel_id, user_id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS import_jobs
+                 (id TEXT PRIMARY KEY,
+                  kind TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'running',
+                  processed INTEGER DEFAULT 0,
+                  imported INTEGER DEFAULT 0,
+                  error_count INTEGER DEFAULT 0,
+                  errors TEXT NOT NULL DEFAULT '[]',
+                  fatal_error TEXT,
+                  started_by INTEGER NOT NULL,
+                  started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  finished_at TIMESTAMP)''')
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_role_school ON users (role, school_number)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs (created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_notifications_unread_sender ON notifications (user_id, sender_id, is_read)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_channel ON channel_messages (channel_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_version ON users (version)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_tombstones_version ON user_tombstones (version)")
+    
     for username, account_data in PRE_CREATED_ACCOUNTS.items():
         c.execute("SELECT COUNT(*) FROM users WHERE username = ?", (username,))
         if c.fetchone()[0] == 0:
@@ -163,42 +534,323 @@ def init_database():
                       account_data['school_number'], account_data['class'], username,
                       account_data['email'], account_data['password'], account_data['role']))
     
+    c.execute('''CREATE TABLE IF NOT EXISTS school_shards
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  school_number TEXT UNIQUE NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''SELECT school_number FROM users
+                 UNION SELECT school_number FROM equipment''')
+    for row in c.fetchall():
+        if row['school_number'] and is_valid_school_number(row['school_number']):
+            register_school(c, row['school_number'])
+        else:
+            print(f"Некорректный номер школы пропущен: {row['school_number']!r}")
+    
     conn.commit()
     conn.close()
+    
+    for school_number in school_shard_numbers():
+        if school_number is not None:
+            init_school_database(school_shard_path(school_number))
 
-def log_action(user_id, action):
+def checkpoint_wal():
+    paths = [MAIN_DB] + [school_shard_path(n) for n in school_shard_numbers() if n is not None]
+    for path in filter(os.path.exists, paths):
+        try:
+            conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
+            # PASSIVE не ждет читателей и не блокирует запись, а размер WAL ограничивает journal_size_limit
+            conn.execute(f"PRAGMA journal_size_limit = {WAL_SIZE_LIMIT}")
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            conn.close()
+        except sqlite3.OperationalError as e:
+            print(f"Ошибка контрольной точки WAL ({path}): {e}")
+
+def run_wal_checkpointer():
+    while True:
+        time.sleep(WAL_CHECKPOINT_INTERVAL)
+        checkpoint_wal()
+
+def start_wal_checkpointer():
+    Thread(target=run_wal_checkpointer, daemon=True).start()
+
+@contextmanager
+def unit_of_work(school_number=None):
+    conn = getattr(unit_of_work_state, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+    
+    conn = get_school_db_connection(school_number)
+    begin_write(conn, school_number)
+    unit_of_work_state.conn = conn
+    unit_of_work_state.central_writes = [] if is_shard_connection(school_number) else None
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''INSERT INTO logs (user_id, action, created_at) VALUES (?, ?, ?)''',
-                 (user_id, action, format_moscow_time()))
+        yield conn
+        conn.commit()
+        central_writes = unit_of_work_state.central_writes
+    except:
+        conn.rollback()
+        raise
+    finally:
+        unit_of_work_state.conn = None
+        unit_of_work_state.central_writes = None
+        conn.close()
+    
+    flush_central_writes(central_writes)
+
+def is_shard_connection(school_number):
+    return SHARDED_MODE and school_number is not None
+
+def begin_write(conn, school_number):
+    if not is_shard_connection(school_number):
+        conn.execute("BEGIN IMMEDIATE")
+        return
+    # BEGIN IMMEDIATE блокирует на запись и присоединенную центральную базу,
+    # поэтому блокировка берется только на файл школы
+    conn.execute("BEGIN")
+    conn.execute("UPDATE main.change_versions SET version = version WHERE 0")
+
+def run_central_write(operation, wait=True):
+    central_writes = getattr(unit_of_work_state, 'central_writes', None)
+    if central_writes is not None:
+        central_writes.append(operation)
+        return None
+    return run_write(operation, wait=wait)
+
+def flush_central_writes(operations):
+    if not operations:
+        return
+    
+    def operation(conn):
+        for central_operation in operations:
+            central_operation(conn)
+    
+    try:
+        run_write(operation, wait=False)
+    except Exception as e:
+        print(f"Ошибка записи в центральную базу: {e}")
+
+@contextmanager
+def use_connection():
+    conn = getattr(unit_of_work_state, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+    
+    conn = get_db_connection()
+    try:
+        yield conn
         conn.commit()
+    finally:
         conn.close()
+
+class WriteQueue:
+    def __init__(self, school_number=None):
+        self.school_number = school_number
+        self.queue = queue.Queue()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def submit(self, operation):
+        future = Future()
+        self.queue.put((operation, future))
+        return future
+    
+    def run(self):
+        conn = None
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = get_school_db_connection(self.school_number)
+                    conn.isolation_level = None
+                self.commit_batch(conn, batch)
+            except Exception as e:
+                print(f"Ошибка очереди записи: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                # Соединение могло сломаться: следующая пачка откроет новое
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except:
+                        pass
+                    conn = None
+    
+    def commit_batch(self, conn, batch):
+        results = []
+        central_writes = [] if is_shard_connection(self.school_number) else None
+        try:
+            begin_write(conn, self.school_number)
+            unit_of_work_state.conn = conn
+            unit_of_work_state.central_writes = central_writes
+            for operation, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_operation")
+                pending_central_writes = len(central_writes) if central_writes is not None else 0
+                try:
+                    results.append((future, operation(conn), None))
+                    conn.execute("RELEASE write_operation")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_operation")
+                    conn.execute("RELEASE write_operation")
+                    if central_writes is not None:
+                        del central_writes[pending_central_writes:]
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            unit_of_work_state.conn = None
+            unit_of_work_state.central_writes = None
+        
+        flush_central_writes(central_writes)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def get_write_queue(school_number=None):
+    key = school_shard_path(school_number) if SHARDED_MODE and school_number is not None else MAIN_DB
+    with write_queues_lock:
+        if key not in write_queues:
+            write_queues[key] = WriteQueue(school_number if SHARDED_MODE else None)
+        return write_queues[key]
+
+def run_write(operation, school_number=None, wait=True):
+    conn = getattr(unit_of_work_state, 'conn', None)
+    if conn is not None:
+        return operation(conn)
+    
+    if WRITE_QUEUE_ENABLED:
+        future = get_write_queue(school_number).submit(operation)
+        if not wait:
+            return None
+        try:
+            return future.result(timeout=WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            raise sqlite3.OperationalError('Превышено время ожидания записи в базу данных')
+    
+    with unit_of_work(school_number) as conn:
+        return operation(conn)
+
+def log_action(user_id, action):
+    created_at = format_moscow_time()
+    
+    def operation(conn):
+        conn.execute('''INSERT INTO logs (user_id, action, created_at) VALUES (?, ?, ?)''',
+                     (user_id, action, created_at))
+    
+    try:
+        run_central_write(operation, wait=False)
     except:
         pass
 
+class Record:
+    __slots__ = ()
+    
+    def __init__(self, *values):
+        slots = type(self).__slots__
+        for name, value in zip(slots, values):
+            setattr(self, name, value)
+        for name in slots[len(values):]:
+            setattr(self, name, None)
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in type(self).__slots__
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def keys(self):
+        return type(self).__slots__
+    
+    def to_dict(self):
+        return {name: getattr(self, name) for name in type(self).__slots__}
+
+class UserRecord(Record):
+    __slots__ = ('id', 'username', 'first_name', 'last_name', 'middle_name', 'school_number', 'class',
+                 'email', 'role', 'is_active', 'created_at', 'avatar', 'role_display')
+
+class ChatUserRecord(Record):
+    __slots__ = ('id', 'username', 'first_name', 'last_name', 'middle_name', 'role', 'version', 'avatar')
+
+class ChatMessageRecord(Record):
+    __slots__ = ('id', 'sender_id', 'receiver_id', 'message', 'is_read', 'created_at',
+                 'first_name', 'last_name', 'username', 'is_me', 'created_at_formatted')
+
+class ChannelMessageRecord(Record):
+    __slots__ = ('id', 'sender_id', 'message', 'created_at', 'first_name', 'last_name', 'username',
+                 'is_me', 'created_at_formatted')
+
+class EquipmentRecord(Record):
+    __slots__ = ('id', 'name', 'description', 'category', 'school_number', 'available', 'quantity',
+                 'image_filename', 'created_by', 'created_at', 'version', 'creator_name', 'image_path')
+
+class StudentRequestRecord(Record):
+    __slots__ = ('id', 'equipment_id', 'status', 'due_date', 'request_date', 'start_at', 'end_at',
+                 'is_reservation', 'equipment_name', 'equipment_description')
+
+class TeacherRequestRecord(Record):
+    __slots__ = ('id', 'student_id', 'equipment_id', 'status', 'due_date', 'request_date', 'approved_by',
+                 'version', 'start_at', 'end_at', 'is_reservation', 'equipment_name', 'equipment_available',
+                 'student_class', 'student_name')
+
+class RecordJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+app.json = RecordJSONProvider(app)
+
+USER_COLUMNS = 'id, username, first_name, last_name, middle_name, school_number, class, email, role, is_active, created_at'
+
 def get_user_by_id(user_id):
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = c.fetchone()
-        conn.close()
+        with use_connection() as conn:
+            user = conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone()
         if user:
-            return format_user_data(dict(user))
+            return format_user_data(UserRecord(*user))
         return None
     except:
         return None
 
-def get_user_by_username(username):
+def authenticate_user(username, password):
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username = ?", (username.upper(),))
-        user = c.fetchone()
+        c.execute("SELECT id, password FROM users WHERE username = ?", (username.upper(),))
+        row = c.fetchone()
         conn.close()
-        if user:
-            return format_user_data(dict(user))
+        if row and row['password'] == password:
+            return row['id']
         return None
     except:
         return None
@@ -207,8 +859,8 @@ def get_all_users():
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute("SELECT * FROM users ORDER BY created_at DESC")
-        users = [format_user_data(dict(row)) for row in c.fetchall()]
+        c.execute(f"SELECT {USER_COLUMNS} FROM users ORDER BY created_at DESC")
+        users = [format_user_data(UserRecord(*row)) for row in c.fetchall()]
         conn.close()
         return users
     except:
@@ -219,67 +871,237 @@ def format_user_data(user_dict):
     user_dict['role_display'] = 'УЧИТЕЛЬ' if user_dict.get('role') == 'teacher' else 'УЧЕНИК'
     return user_dict
 
+EQUIPMENT_QUERY = '''SELECT e.id, e.name, e.description, e.category, e.school_number, e.available, e.quantity,
+                     e.image_filename, e.created_by, e.created_at, e.version,
+                     COALESCE(u.first_name || ' ' || u.last_name, 'Система') AS creator_name
+                     FROM equipment e
+                     LEFT JOIN users u ON e.created_by = u.id
+                     WHERE e.school_number = ? {filter}
+                     ORDER BY e.name'''
+
+def format_equipment(row):
+    item = EquipmentRecord(*row)
+    item.image_path = f"uploads/equipment/{item.image_filename}" if item.image_filename else "images/placeholder.jpg"
+    return item
+
 def get_equipment_by_school(school_number):
     try:
-        conn = get_db_connection()
+        conn = get_school_db_connection(school_number)
         c = conn.cursor()
-        c.execute('''SELECT * FROM equipment WHERE school_number = ? ORDER BY name''', (school_number,))
-        equipment = [dict(row) for row in c.fetchall()]
+        c.execute(EQUIPMENT_QUERY.format(filter=''), (school_number,))
+        equipment = [format_equipment(row) for row in c.fetchall()]
         conn.close()
-        for item in equipment:
-            item['image_path'] = f"uploads/equipment/{item['image_filename']}" if item.get('image_filename') else "images/placeholder.jpg"
-            creator = get_user_by_id(item['created_by']) if item.get('created_by') else None
-            item['creator_name'] = f"{creator['first_name']} {creator['last_name']}" if creator else 'Система'
         return equipment
     except:
         return []
 
-def get_student_requests(student_id):
+def get_equipment_changes(school_number, since, database_id):
+    conn = get_school_db_connection(school_number)
     try:
-        conn = get_db_connection()
         c = conn.cursor()
-        c.execute('''SELECT r.*, e.name as equipment_name, e.description as equipment_description
+        c.execute("SELECT version FROM change_versions WHERE name = 'equipment'")
+        row = c.fetchone()
+        version = row[0] if row else 0
+        current_database_id = get_database_id(c)
+        if since <= 0 or since > version or database_id != current_database_id:
+            c.execute(EQUIPMENT_QUERY.format(filter=''), (school_number,))
+            return {'version': version, 'database': current_database_id, 'full': True,
+                    'changed': [format_equipment(row) for row in c.fetchall()], 'removed': []}
+        
+        c.execute(EQUIPMENT_QUERY.format(filter='AND e.version > ?'), (school_number, since))
+        changed = [format_equipment(row) for row in c.fetchall()]
+        c.execute('''SELECT equipment_id FROM equipment_tombstones
+                     WHERE version > ? AND school_number = ?''', (since, school_number))
+        removed = [row['equipment_id'] for row in c.fetchall()]
+        return {'version': version, 'database': current_database_id, 'full': False,
+                'changed': changed, 'removed': removed}
+    finally:
+        conn.close()
+
+def get_student_requests(student_id, school_number):
+    try:
+        conn = get_school_db_connection(school_number)
+        c = conn.cursor()
+        c.execute('''SELECT r.id, r.equipment_id, r.status, r.due_date, r.request_date, r.start_at, r.end_at,
+                     r.is_reservation, e.name as equipment_name, e.description as equipment_description
                      FROM requests r
                      JOIN equipment e ON r.equipment_id = e.id
                      WHERE r.student_id = ?
                      ORDER BY r.request_date DESC''', (student_id,))
-        requests = [dict(row) for row in c.fetchall()]
+        requests = [StudentRequestRecord(*row) for row in c.fetchall()]
         conn.close()
         return requests
     except:
         return []
 
+TEACHER_REQUESTS_QUERY = '''SELECT r.id, r.student_id, r.equipment_id, r.status, r.due_date, r.request_date,
+                            r.approved_by, r.version, r.start_at, r.end_at, r.is_reservation,
+                            e.name as equipment_name, 
+                            e.available as equipment_available,
+                            u.class as student_class,
+                            u.last_name || ' ' || u.first_name || COALESCE(' ' || NULLIF(u.middle_name, ''), '') as student_name
+                            FROM requests r
+                            JOIN equipment e ON r.equipment_id = e.id
+                            JOIN users u ON r.student_id = u.id
+                            WHERE e.school_number = ? {filter}
+                            ORDER BY r.request_date DESC'''
+
+def format_teacher_request(row):
+    req = TeacherRequestRecord(*row)
+    if req.request_date:
+        req.request_date = format_datetime_display(req.request_date)
+    if req.due_date:
+        req.due_date = format_date_display(req.due_date)
+    return req
+
+def get_requests_version(c):
+    c.execute("SELECT version FROM change_versions WHERE name = 'requests'")
+    row = c.fetchone()
+    return row[0] if row else 0
+
+def get_database_id(c):
+    c.execute("SELECT version FROM change_versions WHERE name = ?", (DATABASE_ID_VERSION_NAME,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
 def get_requests_for_teacher(school_number):
     try:
-        conn = get_db_connection()
+        conn = get_school_db_connection(school_number)
         c = conn.cursor()
-        c.execute('''SELECT r.*, 
-                     e.name as equipment_name, 
-                     e.available as equipment_available,
-                     u.first_name, u.last_name, u.middle_name, u.class as student_class
-                     FROM requests r
-                     JOIN equipment e ON r.equipment_id = e.id
-                     JOIN users u ON r.student_id = u.id
-                     WHERE e.school_number = ? AND r.status != 'returned'
-                     ORDER BY r.request_date DESC''', (school_number,))
-        requests = []
-        for row in c.fetchall():
-            req = dict(row)
-            student_name_parts = [req['last_name'], req['first_name']]
-            if req['middle_name']:
-                student_name_parts.append(req['middle_name'])
-            req['student_name'] = " ".join(student_name_parts)
-            if req.get('request_date'):
-                req['request_date'] = format_datetime_display(req['request_date'])
-            if req.get('due_date'):
-                req['due_date'] = format_date_display(req['due_date'])
-            requests.append(req)
+        c.execute(TEACHER_REQUESTS_QUERY.format(filter="AND r.status != 'returned'"), (school_number,))
+        requests = [format_teacher_request(row) for row in c.fetchall()]
         conn.close()
         return requests
     except Exception as e:
         print(f"Ошибка при получении заявок учителя: {e}")
         return []
 
+def get_teacher_request_changes(school_number, since, database_id):
+    conn = get_school_db_connection(school_number)
+    try:
+        c = conn.cursor()
+        version = get_requests_version(c)
+        current_database_id = get_database_id(c)
+        if since <= 0 or since > version or database_id != current_database_id:
+            c.execute(TEACHER_REQUESTS_QUERY.format(filter="AND r.status != 'returned'"), (school_number,))
+            return {'version': version, 'database': current_database_id, 'full': True,
+                    'changed': [format_teacher_request(row) for row in c.fetchall()], 'removed': []}
+        
+        c.execute(TEACHER_REQUESTS_QUERY.format(filter="AND r.version > ?"), (school_number, since))
+        changed = []
+        removed = []
+        for row in c.fetchall():
+            if row['status'] == 'returned':
+                removed.append(row['id'])
+            else:
+                changed.append(format_teacher_request(row))
+        
+        c.execute('''SELECT request_id FROM request_tombstones
+                     WHERE version > ? AND (school_number = ? OR school_number IS NULL)''',
+                 (since, school_number))
+        removed.extend(row['request_id'] for row in c.fetchall())
+        return {'version': version, 'database': current_database_id, 'full': False,
+                'changed': changed, 'removed': removed}
+    finally:
+        conn.close()
+
+def parse_reservation_time(value, is_end=False):
+    value = (value or '').strip()
+    for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return format_moscow_time(datetime.strptime(value, fmt))
+        except ValueError:
+            pass
+
+    day = datetime.strptime(value, '%Y-%m-%d')
+    if is_end:
+        day += timedelta(days=1)
+    return format_moscow_time(day)
+
+def get_active_intervals(c, equipment_ids, start_at, end_at, exclude_request_id=None):
+    placeholders = ','.join('?' * len(equipment_ids))
+    c.execute(f'''SELECT equipment_id, start_at, end_at FROM requests
+                  WHERE equipment_id IN ({placeholders})
+                    AND status IN ('pending', 'approved')
+                    AND end_at > ? AND start_at < ?
+                    AND id != ?''',
+              list(equipment_ids) + [start_at, end_at, exclude_request_id or 0])
+    intervals = {}
+    for row in c.fetchall():
+        intervals.setdefault(row['equipment_id'], []).append((row['start_at'], row['end_at']))
+    return intervals
+
+def compute_free_slots(intervals, quantity, start_at, end_at):
+    events = {start_at: 0, end_at: 0}
+    for interval_start, interval_end in intervals:
+        events[max(interval_start, start_at)] = events.get(max(interval_start, start_at), 0) + 1
+        if interval_end < end_at:
+            events[interval_end] = events.get(interval_end, 0) - 1
+
+    slots = []
+    busy = 0
+    points = sorted(events)
+    for point, next_point in zip(points, points[1:]):
+        busy += events[point]
+        free = max(quantity - busy, 0)
+        if slots and slots[-1]['free'] == free:
+            slots[-1]['end'] = next_point
+        else:
+            slots.append({'start': point, 'end': next_point, 'free': free})
+    return slots
+
+def has_free_unit(c, equipment_id, quantity, start_at, end_at, exclude_request_id=None):
+    intervals = get_active_intervals(c, [equipment_id], start_at, end_at, exclude_request_id)
+    slots = compute_free_slots(intervals.get(equipment_id, []), quantity, start_at, end_at)
+    return all(slot['free'] > 0 for slot in slots)
+
+def get_equipment_availability(equipment_id, school_number, start_at, end_at):
+    conn = get_school_db_connection(school_number)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id, name, quantity FROM equipment WHERE id = ? AND school_number = ?",
+                 (equipment_id, school_number))
+        equipment = c.fetchone()
+        if not equipment:
+            return None
+
+        intervals = get_active_intervals(c, [equipment_id], start_at, end_at)
+        return {
+            'equipment_id': equipment['id'],
+            'name': equipment['name'],
+            'quantity': equipment['quantity'],
+            'slots': compute_free_slots(intervals.get(equipment_id, []), equipment['quantity'], start_at, end_at)
+        }
+    finally:
+        conn.close()
+
+def get_availability_calendar(school_number, first_day, days):
+    start_at = format_moscow_time(first_day)
+    end_at = format_moscow_time(first_day + timedelta(days=days))
+    day_bounds = [(format_moscow_time(first_day + timedelta(days=i)),
+                   format_moscow_time(first_day + timedelta(days=i + 1))) for i in range(days)]
+
+    conn = get_school_db_connection(school_number)
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT id, name, category, quantity FROM equipment
+                     WHERE school_number = ?
+                     ORDER BY name''', (school_number,))
+        equipment = [dict(row) for row in c.fetchall()]
+        intervals = {}
+        if equipment:
+            intervals = get_active_intervals(c, [item['id'] for item in equipment], start_at, end_at)
+    finally:
+        conn.close()
+
+    for item in equipment:
+        slots = compute_free_slots(intervals.get(item['id'], []), item['quantity'], start_at, end_at)
+        item['days'] = []
+        for day_start, day_end in day_bounds:
+            free = min(slot['free'] for slot in slots if slot['start'] < day_end and slot['end'] > day_start)
+            item['days'].append({'date': day_start[:10], 'free': free})
+    return equipment
+
 def get_unread_notifications_count(user_id):
     try:
         conn = get_db_connection()
@@ -296,65 +1118,254 @@ def get_user_notifications(user_id):
         conn = get_db_connection()
         c = conn.cursor()
         c.execute('''SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC''', (user_id,))
-        notifications = [dict(row) for row in c.fetchall()]
+        notifications = []
+        for row in c.fetchall():
+            notification = dict(row)
+            if notification['count'] > 1:
+                notification['message'] = f"{notification['message']} ({notification['count']})"
+            notifications.append(notification)
         conn.close()
         return notifications
     except:
         return []
 
 def create_notification(user_id, message):
+    def operation(conn):
+        conn.execute('''INSERT INTO notifications (user_id, message, created_at) VALUES (?, ?, ?)''', 
+                     (user_id, safe_input(message), format_moscow_time()))
+    
     try:
-        conn = get_db_connection()
+        run_central_write(operation)
+    except:
+        pass
+
+def create_chat_notification(user_id, sender_id, message):
+    def operation(conn):
+        current_time = format_moscow_time()
         c = conn.cursor()
-        c.execute('''INSERT INTO notifications (user_id, message, created_at) VALUES (?, ?, ?)''', 
-                 (user_id, safe_input(message), format_moscow_time()))
-        conn.commit()
-        conn.close()
+        c.execute('''UPDATE notifications
+                     SET count = CASE WHEN is_read = 1 THEN 1 ELSE count + 1 END,
+                         is_read = 0,
+                         created_at = ?
+                     WHERE id = (SELECT MAX(id) FROM notifications WHERE user_id = ? AND sender_id = ?)''',
+                 (current_time, user_id, sender_id))
+        if c.rowcount == 0:
+            c.execute('''INSERT INTO notifications (user_id, sender_id, message, created_at) VALUES (?, ?, ?, ?)''',
+                     (user_id, sender_id, safe_input(message), current_time))
+    
+    try:
+        run_central_write(operation)
     except:
         pass
 
-def get_chat_users(current_user_id):
+def get_dashboard_stats():
+    now = time.time()
+    with dashboard_stats_lock:
+        if dashboard_stats_cache['data'] is not None and dashboard_stats_cache['expires'] > now:
+            return dashboard_stats_cache['data']
+    
+    stats = {
+        'users_by_role': {'student': 0, 'teacher': 0},
+        'users_by_school': [],
+        'requests_by_status': {'pending': 0, 'approved': 0, 'rejected': 0, 'returned': 0},
+        'equipment': {'items': 0, 'units_available': 0, 'out_of_stock': 0},
+        'activity_per_day': [],
+        'totals': {'users': 0, 'equipment': 0, 'requests': 0, 'logs': 0}
+    }
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute('''SELECT id, username, first_name, last_name, middle_name, role
-                     FROM users 
-                     WHERE id != ?
-                     ORDER BY last_name, first_name''', (current_user_id,))
-        users = []
+        
+        c.execute("SELECT role, COUNT(*) AS count FROM users GROUP BY role")
         for row in c.fetchall():
-            user = dict(row)
-            user['avatar'] = f"{user['last_name'][0]}{user['first_name'][0]}"
-            users.append(user)
+            stats['users_by_role'][row['role']] = row['count']
+        
+        c.execute('''SELECT school_number,
+                     SUM(role = 'student') AS students,
+                     SUM(role = 'teacher') AS teachers
+                     FROM users
+                     GROUP BY school_number
+                     ORDER BY school_number''')
+        stats['users_by_school'] = [dict(row) for row in c.fetchall()]
+        
+        for school_number in school_shard_numbers():
+            school_conn = get_school_db_connection(school_number)
+            school_c = school_conn.cursor()
+            school_c.execute("SELECT status, COUNT(*) AS count FROM requests GROUP BY status")
+            for row in school_c.fetchall():
+                stats['requests_by_status'][row['status']] = stats['requests_by_status'].get(row['status'], 0) + row['count']
+            
+            school_c.execute('''SELECT COUNT(*) AS items,
+                                COALESCE(SUM(available), 0) AS units_available,
+                                COALESCE(SUM(available <= 0), 0) AS out_of_stock
+                                FROM equipment''')
+            for key, value in dict(school_c.fetchone()).items():
+                stats['equipment'][key] += value
+            school_conn.close()
+        
+        since = format_moscow_time(get_moscow_time() - timedelta(days=DASHBOARD_ACTIVITY_DAYS))
+        c.execute('''SELECT substr(created_at, 1, 10) AS day, COUNT(*) AS count
+                     FROM logs
+                     WHERE created_at >= ?
+                     GROUP BY day
+                     ORDER BY day''', (since,))
+        stats['activity_per_day'] = [dict(row) for row in c.fetchall()]
+        
+        c.execute("SELECT COUNT(*) FROM logs")
+        stats['totals'] = {
+            'users': sum(stats['users_by_role'].values()),
+            'equipment': stats['equipment']['items'],
+            'requests': sum(stats['requests_by_status'].values()),
+            'logs': c.fetchone()[0]
+        }
         conn.close()
-        return users
+    except Exception as e:
+        print(f"Ошибка при подсчете статистики: {e}")
+        return stats
+    
+    with dashboard_stats_lock:
+        dashboard_stats_cache['data'] = stats
+        dashboard_stats_cache['expires'] = now + DASHBOARD_STATS_TTL
+    return stats
+
+def invalidate_dashboard_stats():
+    with dashboard_stats_lock:
+        dashboard_stats_cache['expires'] = 0
+
+def get_cached_fragment(key, render):
+    with fragment_cache_lock:
+        if key in fragment_cache:
+            fragment_cache.move_to_end(key)
+            return fragment_cache[key]
+    
+    fragment = render()
+    with fragment_cache_lock:
+        fragment_cache[key] = fragment
+        while len(fragment_cache) > FRAGMENT_CACHE_MAX_ENTRIES:
+            fragment_cache.popitem(last=False)
+    return fragment
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+    
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('render_fragment', [nodes.List(key)]),
+                               [], [], body).set_lineno(lineno)
+    
+    def render_fragment(self, key, caller):
+        if None in key:
+            return caller()
+        return get_cached_fragment(tuple(key), caller)
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+def catalog_version_name(school_number):
+    return f'catalog:{school_number}'
+
+def bump_data_version(conn, name):
+    conn.execute('''INSERT INTO change_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT (name) DO UPDATE SET version = version + 1''', (name,))
+
+def get_catalog_version(school_number):
+    try:
+        conn = get_school_db_connection(school_number)
+        c = conn.cursor()
+        c.execute("SELECT version FROM change_versions WHERE name = ?", (catalog_version_name(school_number),))
+        row = c.fetchone()
+        conn.close()
+        return row[0] if row else 0
     except:
-        return []
+        return None
+
+def get_logs_version():
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT MAX(id) FROM logs")
+        version = c.fetchone()[0] or 0
+        conn.close()
+        return version
+    except:
+        return None
+
+CHAT_USERS_QUERY = '''SELECT id, username, first_name, last_name, middle_name, role, version
+                      FROM users 
+                      WHERE id != ? {filter}
+                      ORDER BY last_name, first_name'''
 
-def get_chat_messages(user1_id, user2_id):
+def format_chat_user(row):
+    user = ChatUserRecord(*row)
+    user.avatar = f"{user.last_name[0]}{user.first_name[0]}"
+    return user
+
+def get_chat_user_changes(current_user_id, since, database_id):
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT version FROM change_versions WHERE name = 'users'")
+        row = c.fetchone()
+        version = row[0] if row else 0
+        current_database_id = get_database_id(c)
+        if since <= 0 or since > version or database_id != current_database_id:
+            c.execute(CHAT_USERS_QUERY.format(filter=''), (current_user_id,))
+            return {'version': version, 'database': current_database_id, 'full': True,
+                    'changed': [format_chat_user(row) for row in c.fetchall()], 'removed': []}
+        
+        c.execute(CHAT_USERS_QUERY.format(filter='AND version > ?'), (current_user_id, since))
+        changed = [format_chat_user(row) for row in c.fetchall()]
+        c.execute("SELECT user_id FROM user_tombstones WHERE version > ?", (since,))
+        removed = [row['user_id'] for row in c.fetchall()]
+        return {'version': version, 'database': current_database_id, 'full': False,
+                'changed': changed, 'removed': removed}
+    finally:
+        conn.close()
+
+def get_chat_messages(user1_id, user2_id, after_id=0):
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute('''SELECT cm.*, u.first_name, u.last_name, u.username
+        c.execute('''SELECT cm.id, cm.sender_id, cm.receiver_id, cm.message, cm.is_read, cm.created_at,
+                     u.first_name, u.last_name, u.username
                      FROM chat_messages cm
                      JOIN users u ON cm.sender_id = u.id
-                     WHERE (cm.sender_id = ? AND cm.receiver_id = ?)
-                        OR (cm.sender_id = ? AND cm.receiver_id = ?)
+                     WHERE ((cm.sender_id = ? AND cm.receiver_id = ?)
+                        OR (cm.sender_id = ? AND cm.receiver_id = ?))
+                       AND cm.id > ?
                      ORDER BY cm.created_at ASC
                      LIMIT 100''',
-                 (user1_id, user2_id, user2_id, user1_id))
+                 (user1_id, user2_id, user2_id, user1_id, after_id))
         messages = []
         for row in c.fetchall():
-            msg = dict(row)
-            msg['is_me'] = msg['sender_id'] == user1_id
-            msg['created_at_formatted'] = format_datetime_display(msg['created_at'])
+            msg = ChatMessageRecord(*row)
+            msg.is_me = msg.sender_id == user1_id
+            msg.created_at_formatted = format_datetime_display(msg.created_at)
             messages.append(msg)
-        c.execute('''UPDATE chat_messages 
-                     SET is_read = 1 
-                     WHERE receiver_id = ? AND sender_id = ? AND is_read = 0''',
-                 (user1_id, user2_id))
-        conn.commit()
+        c.execute('''SELECT 1 FROM chat_messages
+                     WHERE receiver_id = ? AND sender_id = ? AND is_read = 0
+                     UNION ALL
+                     SELECT 1 FROM notifications
+                     WHERE user_id = ? AND sender_id = ? AND is_read = 0
+                     LIMIT 1''', (user1_id, user2_id, user1_id, user2_id))
+        has_unread = c.fetchone() is not None
         conn.close()
+        
+        def mark_read(conn):
+            conn.execute('''UPDATE chat_messages 
+                            SET is_read = 1 
+                            WHERE receiver_id = ? AND sender_id = ? AND is_read = 0''',
+                         (user1_id, user2_id))
+            conn.execute('''UPDATE notifications 
+                            SET is_read = 1 
+                            WHERE user_id = ? AND sender_id = ? AND is_read = 0''',
+                         (user1_id, user2_id))
+        
+        if has_unread:
+            run_write(mark_read)
         return messages
     except:
         return []
@@ -373,10 +1384,165 @@ def get_unread_chat_count(user_id):
     except:
         return 0
 
+def get_channel_classes(user):
+    if user['role'] == 'student':
+        return ['', user['class']]
+    
+    with use_connection() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT DISTINCT class FROM users
+                     WHERE school_number = ? AND role = 'student'
+                     ORDER BY class''', (user['school_number'],))
+        return [''] + [row['class'] for row in c.fetchall()]
+
+def can_access_channel(user, channel):
+    if channel['school_number'] != user['school_number']:
+        return False
+    return user['role'] != 'student' or channel['class'] in ('', user['class'])
+
+def get_channel(channel_id):
+    with use_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM channels WHERE id = ?", (channel_id,))
+        row = c.fetchone()
+        return dict(row) if row else None
+
+def get_user_channels(user):
+    classes = get_channel_classes(user)
+    placeholders = ','.join('?' * len(classes))
+    query = f'''SELECT ch.id, ch.school_number, ch.class,
+                       COALESCE(r.last_read_id, 0) AS last_read_id,
+                       (SELECT COUNT(*) FROM channel_messages m
+                        WHERE m.channel_id = ch.id
+                          AND m.id > COALESCE(r.last_read_id, 0)
+                          AND m.sender_id != ?) AS unread_count
+                FROM channels ch
+                LEFT JOIN channel_reads r ON r.channel_id = ch.id AND r.user_id = ?
+                WHERE ch.school_number = ? AND ch.class IN ({placeholders})
+                ORDER BY ch.class'''
+    params = [user['id'], user['id'], user['school_number']] + classes
+    
+    with use_connection() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        channels = [dict(row) for row in c.fetchall()]
+    
+    if len(channels) < len(classes):
+        existing = {channel['class'] for channel in channels}
+        missing = [class_name for class_name in classes if class_name not in existing]
+        
+        def create_channels(conn):
+            conn.executemany("INSERT OR IGNORE INTO channels (school_number, class) VALUES (?, ?)",
+                             [(user['school_number'], class_name) for class_name in missing])
+        
+        run_write(create_channels)
+        with use_connection() as conn:
+            c = conn.cursor()
+            c.execute(query, params)
+            channels = [dict(row) for row in c.fetchall()]
+    
+    for channel in channels:
+        channel['title'] = f"{channel['class']} класс" if channel['class'] else f"Школа №{channel['school_number']}"
+    return channels
+
+def get_channel_messages(channel_id, user_id, limit=100):
+    with use_connection() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT * FROM (
+                         SELECT m.id, m.sender_id, m.message, m.created_at,
+                                u.first_name, u.last_name, u.username
+                         FROM channel_messages m
+                         JOIN users u ON m.sender_id = u.id
+                         WHERE m.channel_id = ?
+                         ORDER BY m.id DESC
+                         LIMIT ?)
+                     ORDER BY id ASC''', (channel_id, limit))
+        messages = []
+        for row in c.fetchall():
+            msg = ChannelMessageRecord(*row)
+            msg.is_me = msg.sender_id == user_id
+            msg.created_at_formatted = format_datetime_display(msg.created_at)
+            messages.append(msg)
+        
+        c.execute("SELECT last_read_id FROM channel_reads WHERE channel_id = ? AND user_id = ?",
+                 (channel_id, user_id))
+        row = c.fetchone()
+        last_read_id = row['last_read_id'] if row else 0
+    
+    if messages and messages[-1].id > last_read_id:
+        run_write(lambda conn: mark_channel_read(conn, channel_id, user_id, messages[-1].id))
+    return messages
+
+def mark_channel_read(conn, channel_id, user_id, message_id):
+    conn.execute('''INSERT INTO channel_reads (channel_id, user_id, last_read_id)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (channel_id, user_id)
+                    DO UPDATE SET last_read_id = MAX(last_read_id, excluded.last_read_id)''',
+                 (channel_id, user_id, message_id))
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+def find_limit(limits, method, path):
+    for key, limit in limits.items():
+        key_method, _, prefix = key.rpartition(' ')
+        if key_method in ('', method) and path.startswith(prefix):
+            return key, limit
+    return None, None
+
+def check_rate_limit(client_key, method, path):
+    limit_key, limit = find_limit(RATE_LIMITS, method, path)
+    if limit is None:
+        return 0
+    
+    rate, capacity = limit
+    key = (client_key, limit_key)
+    with rate_limit_lock:
+        bucket = rate_limit_buckets.get(key)
+        if bucket is None:
+            if len(rate_limit_buckets) >= RATE_LIMIT_MAX_BUCKETS:
+                cutoff = time.monotonic() - RATE_LIMIT_IDLE_SECONDS
+                for stale_key in [k for k, b in rate_limit_buckets.items() if b.updated < cutoff]:
+                    del rate_limit_buckets[stale_key]
+            bucket = rate_limit_buckets[key] = TokenBucket(rate, capacity)
+        return bucket.consume()
+
+def acquire_concurrency_slot(method, path):
+    _, slot = find_limit(concurrency_slots, method, path)
+    if slot is None:
+        return True
+    if not slot.acquire(blocking=False):
+        return False
+    request.environ['schooltech.concurrency_slot'] = slot
+    return True
+
+def too_many_requests(retry_after):
+    message = 'Слишком много запросов, попробуйте позже'
+    if request.method == 'POST':
+        response = jsonify({'success': False, 'error': message})
+    else:
+        response = Response(message, mimetype='text/plain')
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
 @app.before_request
 def basic_security():
     if request.method == 'POST':
-        protected_paths = ['/chat/send', '/add_equipment', '/request_equipment', 
+        protected_paths = ['/chat/send', '/chat/channels/', '/add_equipment', '/request_equipment', 
                           '/update_request_status', '/admin/', '/update_profile']
         for path in protected_paths:
             if request.path.startswith(path):
@@ -385,8 +1551,27 @@ def basic_security():
                         return jsonify({'success': False, 'error': 'Требуется авторизация'}), 401
                     return redirect(url_for('login'))
                 break
+        
+        retry_after = check_rate_limit(session.get('user_id') or request.remote_addr, request.method, request.path)
+        if retry_after:
+            return too_many_requests(retry_after)
+    
+    if not acquire_concurrency_slot(request.method, request.path):
+        return too_many_requests(1)
     return None
 
+@app.after_request
+def hold_concurrency_slot_while_streaming(response):
+    if response.is_streamed and 'schooltech.concurrency_slot' in request.environ:
+        response.call_on_close(request.environ.pop('schooltech.concurrency_slot').release)
+    return response
+
+@app.teardown_request
+def release_concurrency_slot(exc):
+    slot = request.environ.pop('schooltech.concurrency_slot', None)
+    if slot is not None:
+        slot.release()
+
 @app.route('/')
 def home():
     if 'user_id' in session:
@@ -409,25 +1594,31 @@ def register():
             if not all(data[field] for field in required_fields):
                 return render_template('register.html', error='Заполните все обязательные поля')
             
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM users WHERE username = ? OR email = ?", 
-                     (data['username'].upper(), data['email']))
-            if c.fetchone()[0] > 0:
-                conn.close()
-                return render_template('register.html', error='Логин или email уже заняты')
+            if not is_valid_school_number(data['school_number']):
+                return render_template('register.html', error='Некорректный номер школы')
             
-            c.execute('''INSERT INTO users 
-                        (first_name, last_name, middle_name, school_number, class, username, email, password, role)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'student')''',
-                     (data['first_name'], data['last_name'], data['middle_name'],
-                      data['school_number'], data['class'], data['username'].upper(),
-                      data['email'], data['password']))
-            conn.commit()
-            user_id = c.lastrowid
-            conn.close()
+            def operation(conn):
+                c = conn.cursor()
+                c.execute("SELECT COUNT(*) FROM users WHERE username = ? OR email = ?", 
+                         (data['username'].upper(), data['email']))
+                if c.fetchone()[0] > 0:
+                    return None
+                
+                c.execute('''INSERT INTO users 
+                            (first_name, last_name, middle_name, school_number, class, username, email, password, role)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'student')''',
+                         (data['first_name'], data['last_name'], data['middle_name'],
+                          data['school_number'], data['class'], data['username'].upper(),
+                          data['email'], data['password']))
+                user_id = c.lastrowid
+                register_school(c, data['school_number'])
+                
+                log_action(user_id, 'REGISTER')
+                return user_id
             
-            log_action(user_id, 'REGISTER')
+            user_id = run_write(operation)
+            if not user_id:
+                return render_template('register.html', error='Логин или email уже заняты')
             session['user_id'] = user_id
             return redirect(url_for('home'))
             
@@ -449,11 +1640,11 @@ def login():
             if not username or not password:
                 return render_template('login.html', error='Заполните все поля')
             
-            user = get_user_by_username(username)
+            user_id = authenticate_user(username, password)
             
-            if user and user['password'] == password:
-                session['user_id'] = user['id']
-                log_action(user['id'], 'LOGIN')
+            if user_id:
+                session['user_id'] = user_id
+                log_action(user_id, 'LOGIN')
                 return redirect(url_for('home'))
             else:
                 return render_template('login.html', error='Неверный логин или пароль')
@@ -491,14 +1682,15 @@ def rentals():
     if not user_data:
         return redirect(url_for('register'))
     
-    equipment = get_equipment_by_school(user_data['school_number'])
     student_requests = []
     
     if user_data['role'] == 'student':
-        student_requests = get_student_requests(session['user_id'])
+        student_requests = get_student_requests(session['user_id'], user_data['school_number'])
     
     unread_count = get_unread_notifications_count(session['user_id'])
-    return render_template('rentals.html', user=user_data, equipment=equipment, 
+    return render_template('rentals.html', user=user_data,
+                         catalog_version=get_catalog_version(user_data['school_number']),
+                         load_equipment=lambda: get_equipment_by_school(user_data['school_number']),
                          student_requests=student_requests, unread_count=unread_count)
 
 @app.route('/school')
@@ -510,9 +1702,11 @@ def school_page():
     if not user_data:
         return redirect(url_for('register'))
     
-    equipment = get_equipment_by_school(user_data['school_number'])
     unread_count = get_unread_notifications_count(session['user_id'])
-    return render_template('school.html', user=user_data, equipment=equipment, unread_count=unread_count)
+    return render_template('school.html', user=user_data,
+                         catalog_version=get_catalog_version(user_data['school_number']),
+                         load_equipment=lambda: get_equipment_by_school(user_data['school_number']),
+                         unread_count=unread_count)
 
 @app.route('/chat')
 def chat_page():
@@ -523,12 +1717,10 @@ def chat_page():
     if not user_data:
         return redirect(url_for('register'))
     
-    chat_users = get_chat_users(session['user_id'])
     unread_count = get_unread_notifications_count(session['user_id'])
     
     return render_template('chat.html', 
                          user=user_data, 
-                         chat_users=chat_users,
                          unread_count=unread_count)
 
 @app.route('/chat/messages/<int:receiver_id>')
@@ -536,12 +1728,26 @@ def get_chat_messages_route(receiver_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Не авторизован'})
     
+    after_id = request.args.get('after', 0, type=int)
     try:
-        messages = get_chat_messages(session['user_id'], receiver_id)
+        messages = get_chat_messages(session['user_id'], receiver_id, after_id)
         return jsonify({'success': True, 'messages': messages})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/chat/users/changes')
+def chat_users_changes():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    since = request.args.get('since', 0, type=int)
+    database_id = request.args.get('database', 0, type=int)
+    try:
+        changes = get_chat_user_changes(session['user_id'], since, database_id)
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/chat/send', methods=['POST'])
 def send_chat_message():
     if 'user_id' not in session:
@@ -565,27 +1771,26 @@ def send_chat_message():
     if not receiver:
         return jsonify({'success': False, 'error': 'Получатель не найден'})
     
-    try:
-        conn = get_db_connection()
+    sender_id = session['user_id']
+    current_time = format_moscow_time()
+    
+    def operation(conn):
         c = conn.cursor()
-        
-        current_time = format_moscow_time()
-        
         c.execute('''INSERT INTO chat_messages (sender_id, receiver_id, message, created_at)
                      VALUES (?, ?, ?, ?)''',
-                 (session['user_id'], receiver_id, message, current_time))
-        
-        sender = get_user_by_id(session['user_id'])
-        if sender:
-            create_notification(receiver_id, 
-                              f'Новое сообщение от {sender["first_name"]} {sender["last_name"]}')
-        
-        conn.commit()
+                 (sender_id, receiver_id, message, current_time))
         message_id = c.lastrowid
-        conn.close()
         
-        log_action(session['user_id'], f'SEND_CHAT_MESSAGE to {receiver_id}')
+        sender = get_user_by_id(sender_id)
+        if sender:
+            create_chat_notification(receiver_id, sender_id,
+                                     f'Новое сообщение от {sender["first_name"]} {sender["last_name"]}')
         
+        log_action(sender_id, f'SEND_CHAT_MESSAGE to {receiver_id}')
+        return message_id
+    
+    try:
+        message_id = run_write(operation)
         return jsonify({
             'success': True, 
             'message_id': message_id,
@@ -602,8 +1807,79 @@ def get_unread_chat_count_route():
         return jsonify({'success': False, 'error': 'Не авторизован'})
     
     try:
-        count = get_unread_chat_count(session['user_id'])
-        return jsonify({'success': True, 'unread_count': count})
+        count = get_unread_chat_count(session['user_id'])
+        return jsonify({'success': True, 'unread_count': count})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/chat/channels')
+def get_channels_route():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data:
+        return jsonify({'success': False, 'error': 'Пользователь не найден'})
+    
+    try:
+        return jsonify({'success': True, 'channels': get_user_channels(user_data)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/chat/channels/<int:channel_id>/messages')
+def get_channel_messages_route(channel_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    channel = get_channel(channel_id)
+    if not user_data or not channel or not can_access_channel(user_data, channel):
+        return jsonify({'success': False, 'error': 'Канал не найден'})
+    
+    try:
+        messages = get_channel_messages(channel_id, user_data['id'])
+        return jsonify({'success': True, 'messages': messages})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/chat/channels/<int:channel_id>/send', methods=['POST'])
+def send_channel_message(channel_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'}), 401
+    
+    message = safe_input(request.form.get('message', '').strip())
+    if not message:
+        return jsonify({'success': False, 'error': 'Сообщение не может быть пустым'})
+    
+    if len(message) > 1000:
+        return jsonify({'success': False, 'error': 'Сообщение слишком длинное'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    channel = get_channel(channel_id)
+    if not user_data or not channel or not can_access_channel(user_data, channel):
+        return jsonify({'success': False, 'error': 'Канал не найден'})
+    
+    sender_id = user_data['id']
+    current_time = format_moscow_time()
+    
+    def operation(conn):
+        c = conn.cursor()
+        c.execute('''INSERT INTO channel_messages (channel_id, sender_id, message, created_at)
+                     VALUES (?, ?, ?, ?)''',
+                 (channel_id, sender_id, message, current_time))
+        message_id = c.lastrowid
+        mark_channel_read(conn, channel_id, sender_id, message_id)
+        log_action(sender_id, f'SEND_CHANNEL_MESSAGE to {channel_id}')
+        return message_id
+    
+    try:
+        message_id = run_write(operation)
+        return jsonify({
+            'success': True,
+            'message_id': message_id,
+            'created_at': current_time,
+            'created_at_formatted': format_datetime_display(current_time)
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -629,22 +1905,22 @@ def add_equipment():
         file = request.files['equipment_image']
         if file and file.filename:
             from werkzeug.utils import secure_filename
-            import uuid
             filename = secure_filename(file.filename)
             image_filename = f"{uuid.uuid4().hex}_{filename}"
             file.save(os.path.join(app.config['UPLOAD_FOLDER'], image_filename))
     
+    creator_id = session['user_id']
+    
+    def operation(conn):
+        conn.execute('''INSERT INTO equipment 
+                        (name, description, category, school_number, available, image_filename, created_by)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (name.upper(), description, category, user_data['school_number'], available, image_filename, creator_id))
+        bump_data_version(conn, catalog_version_name(user_data['school_number']))
+        log_action(creator_id, 'ADD_EQUIPMENT')
+    
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''INSERT INTO equipment 
-                    (name, description, category, school_number, available, image_filename, created_by)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                 (name.upper(), description, category, user_data['school_number'], available, image_filename, session['user_id']))
-        conn.commit()
-        conn.close()
-        
-        log_action(session['user_id'], 'ADD_EQUIPMENT')
+        run_write(operation, user_data['school_number'])
         return jsonify({'success': True})
     except:
         return jsonify({'success': False, 'error': 'Ошибка базы'})
@@ -671,29 +1947,55 @@ def request_equipment():
     except:
         return jsonify({'success': False, 'error': 'Неверный ID оборудования'})
     
-    try:
-        conn = get_db_connection()
+    is_reservation = bool(request.form.get('start_at'))
+    if is_reservation:
+        try:
+            start_at = parse_reservation_time(request.form.get('start_at'))
+            end_at = parse_reservation_time(request.form.get('end_at'), is_end=True)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Неверный формат времени. Используйте ГГГГ-ММ-ДД ЧЧ:ММ'})
+        
+        if end_at <= start_at:
+            return jsonify({'success': False, 'error': 'Время окончания должно быть позже начала'})
+        if start_at < format_moscow_time(get_moscow_time() - timedelta(minutes=5)):
+            return jsonify({'success': False, 'error': 'Нельзя забронировать время в прошлом'})
+    else:
+        start_at = format_moscow_time()
+        end_at = format_moscow_time(get_moscow_time() + timedelta(days=DEFAULT_LOAN_DAYS))
+    
+    student_id = session['user_id']
+    
+    def operation(conn):
         c = conn.cursor()
         
         c.execute("SELECT * FROM equipment WHERE id = ?", (equipment_id,))
         equipment = c.fetchone()
         
         if not equipment:
-            return jsonify({'success': False, 'error': 'Оборудование не найдено'})
+            return 'Оборудование не найдено'
         
         equipment_dict = dict(equipment)
         
-        if equipment_dict.get('available', 0) <= 0:
-            return jsonify({'success': False, 'error': 'Оборудование недоступно'})
+        if not is_reservation and equipment_dict.get('available', 0) <= 0:
+            return 'Оборудование недоступно'
         
-        c.execute("UPDATE equipment SET available = available - 1 WHERE id = ?", (equipment_id,))
-        c.execute('''INSERT INTO requests (student_id, equipment_id, status) VALUES (?, ?, 'pending')''', 
-                 (session['user_id'], equipment_id))
+        if not has_free_unit(c, equipment_id, equipment_dict['quantity'], start_at, end_at):
+            return 'Оборудование занято в выбранное время'
         
-        conn.commit()
-        conn.close()
+        if not is_reservation:
+            c.execute("UPDATE equipment SET available = available - 1 WHERE id = ?", (equipment_id,))
+        c.execute('''INSERT INTO requests (student_id, equipment_id, status, start_at, end_at, is_reservation)
+                     VALUES (?, ?, 'pending', ?, ?, ?)''', 
+                 (student_id, equipment_id, start_at, end_at, int(is_reservation)))
+        bump_data_version(conn, catalog_version_name(user_data['school_number']))
         
-        log_action(session['user_id'], 'REQUEST_EQUIPMENT')
+        log_action(student_id, 'RESERVE_EQUIPMENT' if is_reservation else 'REQUEST_EQUIPMENT')
+        return None
+    
+    try:
+        error = run_write(operation, user_data['school_number'])
+        if error:
+            return jsonify({'success': False, 'error': error})
         return jsonify({'success': True})
         
     except:
@@ -715,51 +2017,63 @@ def update_request_status():
     if not request_id or status not in ['approved', 'rejected', 'returned']:
         return jsonify({'success': False, 'error': 'Некорректные данные'})
     
-    try:
-        conn = get_db_connection()
+    if status == 'approved' and due_date:
+        try:
+            datetime.strptime(due_date, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Неверный формат даты. Используйте ГГГГ-ММ-ДД'})
+    
+    teacher_id = session['user_id']
+    
+    def operation(conn):
         c = conn.cursor()
         
         c.execute("SELECT * FROM requests WHERE id = ?", (request_id,))
         request_data = c.fetchone()
         if not request_data:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Заявка не найдена'})
+            return 'Заявка не найдена'
         
         request_dict = dict(request_data)
         
         if status == 'approved':
-            if not due_date:
-                conn.close()
-                return jsonify({'success': False, 'error': 'Укажите дату возврата'})
-            
-            try:
-                datetime.strptime(due_date, '%Y-%m-%d')
-            except ValueError:
-                conn.close()
-                return jsonify({'success': False, 'error': 'Неверный формат даты. Используйте ГГГГ-ММ-ДД'})
-            
-            c.execute("SELECT available FROM equipment WHERE id = ?", (request_dict['equipment_id'],))
+            c.execute("SELECT available, quantity FROM equipment WHERE id = ?", (request_dict['equipment_id'],))
             equipment = c.fetchone()
-            if not equipment or dict(equipment)['available'] <= 0:
-                conn.close()
-                return jsonify({'success': False, 'error': 'Оборудование больше недоступно'})
+            if not equipment:
+                return 'Оборудование больше недоступно'
+            
+            if request_dict['is_reservation']:
+                approved_due_date = due_date or request_dict['end_at'][:10]
+                end_at = request_dict['end_at']
+                message = (f'Бронирование одобрено: {format_moscow_datetime_display(request_dict["start_at"])} — '
+                           f'{format_moscow_datetime_display(end_at)}')
+            else:
+                if not due_date:
+                    return 'Укажите дату возврата'
+                if dict(equipment)['available'] <= 0:
+                    return 'Оборудование больше недоступно'
+                approved_due_date = due_date
+                end_at = format_moscow_time(datetime.strptime(due_date, '%Y-%m-%d') + timedelta(days=1))
+                if not has_free_unit(c, request_dict['equipment_id'], equipment['quantity'],
+                                     request_dict['start_at'], end_at, request_dict['id']):
+                    return 'На выбранный срок оборудование уже забронировано'
+                message = f'Заявка на оборудование одобрена! Дата возврата: {due_date}'
             
             c.execute('''UPDATE requests 
-                        SET status = ?, due_date = ?, approved_by = ?
+                        SET status = ?, due_date = ?, approved_by = ?, end_at = ?
                         WHERE id = ?''',
-                     (status, due_date, session['user_id'], request_id))
+                     (status, approved_due_date, teacher_id, end_at, request_id))
             
-            create_notification(request_dict['student_id'], 
-                              f'Заявка на оборудование одобрена! Дата возврата: {due_date}')
+            create_notification(request_dict['student_id'], message)
             
         elif status == 'returned':
-            c.execute('''UPDATE requests SET status = ? WHERE id = ?''', 
-                     (status, request_id))
+            c.execute('''UPDATE requests SET status = ?, end_at = ? WHERE id = ?''', 
+                     (status, format_moscow_time(), request_id))
             
-            c.execute('''UPDATE equipment 
-                        SET available = available + 1 
-                        WHERE id = ?''', 
-                     (request_dict['equipment_id'],))
+            if not request_dict['is_reservation']:
+                c.execute('''UPDATE equipment 
+                            SET available = available + 1 
+                            WHERE id = ?''', 
+                         (request_dict['equipment_id'],))
             
             create_notification(request_dict['student_id'],
                               'Оборудование возвращено и готово к новым заявкам')
@@ -768,18 +2082,23 @@ def update_request_status():
             c.execute('''UPDATE requests SET status = ? WHERE id = ?''', 
                      (status, request_id))
             
-            c.execute('''UPDATE equipment 
-                        SET available = available + 1 
-                        WHERE id = ?''', 
-                     (request_dict['equipment_id'],))
+            if not request_dict['is_reservation']:
+                c.execute('''UPDATE equipment 
+                            SET available = available + 1 
+                            WHERE id = ?''', 
+                         (request_dict['equipment_id'],))
             
             create_notification(request_dict['student_id'],
                               'Ваша заявка на оборудование отклонена')
         
-        conn.commit()
-        conn.close()
-        
-        log_action(session['user_id'], f'UPDATE_REQUEST {request_id} to {status}')
+        bump_data_version(conn, catalog_version_name(user_data['school_number']))
+        log_action(teacher_id, f'UPDATE_REQUEST {request_id} to {status}')
+        return None
+    
+    try:
+        error = run_write(operation, user_data['school_number'])
+        if error:
+            return jsonify({'success': False, 'error': error})
         return jsonify({'success': True})
         
     except Exception as e:
@@ -797,6 +2116,95 @@ def teacher_requests():
     requests = get_requests_for_teacher(user_data['school_number'])
     return jsonify({'success': True, 'requests': requests})
 
+@app.route('/teacher_requests/changes')
+def teacher_requests_changes():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data or user_data['role'] != 'teacher':
+        return jsonify({'success': False, 'error': 'Доступ запрещен'})
+    
+    since = request.args.get('since', 0, type=int)
+    database_id = request.args.get('database', 0, type=int)
+    try:
+        changes = get_teacher_request_changes(user_data['school_number'], since, database_id)
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/equipment/changes')
+def equipment_changes():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data:
+        return jsonify({'success': False, 'error': 'Пользователь не найден'})
+    
+    since = request.args.get('since', 0, type=int)
+    database_id = request.args.get('database', 0, type=int)
+    try:
+        changes = get_equipment_changes(user_data['school_number'], since, database_id)
+        return jsonify({'success': True, **changes})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/sw.js')
+def service_worker():
+    response = app.send_static_file('sw.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
+@app.route('/equipment/<int:equipment_id>/availability')
+def equipment_availability(equipment_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data:
+        return jsonify({'success': False, 'error': 'Пользователь не найден'})
+
+    try:
+        start_at = parse_reservation_time(request.args.get('from') or format_moscow_time()[:10])
+        end_at = parse_reservation_time(request.args.get('to') or start_at[:10], is_end=True)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Неверный формат времени. Используйте ГГГГ-ММ-ДД ЧЧ:ММ'})
+
+    if end_at <= start_at:
+        return jsonify({'success': False, 'error': 'Время окончания должно быть позже начала'})
+
+    try:
+        availability = get_equipment_availability(equipment_id, user_data['school_number'], start_at, end_at)
+        if not availability:
+            return jsonify({'success': False, 'error': 'Оборудование не найдено'})
+        return jsonify({'success': True, **availability})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/availability_calendar')
+def availability_calendar():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data:
+        return jsonify({'success': False, 'error': 'Пользователь не найден'})
+
+    try:
+        first_day = datetime.strptime(request.args.get('from') or format_moscow_time()[:10], '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Неверный формат даты. Используйте ГГГГ-ММ-ДД'})
+    days = min(max(request.args.get('days', CALENDAR_DEFAULT_DAYS, type=int), 1), CALENDAR_MAX_DAYS)
+
+    try:
+        equipment = get_availability_calendar(user_data['school_number'], first_day, days)
+        return jsonify({'success': True, 'from': first_day.strftime('%Y-%m-%d'), 'days': days,
+                        'equipment': equipment})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/admin')
 def admin_panel():
     if 'user_id' not in session:
@@ -806,22 +2214,23 @@ def admin_panel():
     if not user_data or user_data['role'] != 'teacher':
         return "Доступ запрещен", 403
     
-    users = get_all_users()
-    student_count = len([u for u in users if u['role'] == 'student'])
-    teacher_count = len([u for u in users if u['role'] == 'teacher'])
+    stats = get_dashboard_stats()
+    student_count = stats['users_by_role'].get('student', 0)
+    teacher_count = stats['users_by_role'].get('teacher', 0)
     
-    logs = []
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''SELECT l.action, l.created_at, u.username, u.first_name, u.last_name 
-                     FROM logs l 
-                     LEFT JOIN users u ON l.user_id = u.id
-                     ORDER BY l.created_at DESC LIMIT 50''')
-        logs = [dict(row) for row in c.fetchall()]
-        conn.close()
-    except:
-        pass
+    def load_logs():
+        try:
+            conn = get_db_connection()
+            c = conn.cursor()
+            c.execute('''SELECT l.action, l.created_at, u.username, u.first_name, u.last_name 
+                         FROM logs l 
+                         LEFT JOIN users u ON l.user_id = u.id
+                         ORDER BY l.created_at DESC LIMIT 50''')
+            logs = [dict(row) for row in c.fetchall()]
+            conn.close()
+            return logs
+        except:
+            return []
     
     unread_count = get_unread_notifications_count(session['user_id'])
     
@@ -829,9 +2238,22 @@ def admin_panel():
                          user=user_data,
                          student_count=student_count,
                          teacher_count=teacher_count,
-                         logs=logs,
+                         stats=stats,
+                         logs_version=get_logs_version(),
+                         load_logs=load_logs,
                          unread_count=unread_count)
 
+@app.route('/admin/stats')
+def admin_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data or user_data['role'] != 'teacher':
+        return jsonify({'success': False, 'error': 'Доступ запрещен'})
+    
+    return jsonify({'success': True, 'stats': get_dashboard_stats()})
+
 @app.route('/admin/send_notification', methods=['POST'])
 def admin_send_notification():
     if 'user_id' not in session:
@@ -856,12 +2278,21 @@ def admin_send_notification():
     else:
         target_users = users
     
-    sent_count = 0
-    for user in target_users:
-        create_notification(user['id'], message)
-        sent_count += 1
+    sender_id = session['user_id']
+    
+    def operation(conn):
+        sent_count = 0
+        for user in target_users:
+            create_notification(user['id'], message)
+            sent_count += 1
+        
+        log_action(sender_id, 'SEND_NOTIFICATION')
+        return sent_count
     
-    log_action(session['user_id'], 'SEND_NOTIFICATION')
+    try:
+        sent_count = run_write(operation)
+    except:
+        return jsonify({'success': False, 'error': 'Ошибка базы'})
     
     return jsonify({
         'success': True, 
@@ -877,14 +2308,15 @@ def admin_clear_logs():
     if not user_data or user_data['role'] != 'teacher':
         return jsonify({'success': False, 'error': 'Доступ запрещен'})
     
+    admin_id = session['user_id']
+    
+    def operation(conn):
+        conn.execute("DELETE FROM logs")
+        log_action(admin_id, 'CLEAR_LOGS')
+    
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("DELETE FROM logs")
-        conn.commit()
-        conn.close()
-        
-        log_action(session['user_id'], 'CLEAR_LOGS')
+        run_write(operation)
+        invalidate_dashboard_stats()
         return jsonify({'success': True})
     except:
         return jsonify({'success': False, 'error': 'Ошибка очистки'})
@@ -898,8 +2330,15 @@ def view_databases():
     if not user_data or user_data['role'] != 'teacher':
         return "Доступ запрещен", 403
     
-    users = get_all_users()
-    
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * DATABASES_PAGE_SIZE
+    
+    stats = get_dashboard_stats()
+    totals = dict(stats['totals'])
+    users = []
     equipment = []
     requests = []
     logs = []
@@ -907,14 +2346,9 @@ def view_databases():
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute("SELECT * FROM equipment")
-        equipment = [dict(row) for row in c.fetchall()]
-        
-        c.execute('''SELECT r.*, u.username as student_username, e.name as equipment_name 
-                     FROM requests r 
-                     LEFT JOIN users u ON r.student_id = u.id 
-                     LEFT JOIN equipment e ON r.equipment_id = e.id''')
-        requests = [dict(row) for row in c.fetchall()]
+        c.execute('''SELECT id, username, first_name, last_name, middle_name, school_number, class, role, created_at
+                     FROM users ORDER BY id DESC LIMIT ? OFFSET ?''', (DATABASES_PAGE_SIZE, offset))
+        users = [format_user_data(dict(row)) for row in c.fetchall()]
         
         c.execute('''SELECT l.action, l.created_at, u.username 
                      FROM logs l 
@@ -922,19 +2356,366 @@ def view_databases():
                      ORDER BY l.created_at DESC LIMIT 100''')
         logs = [dict(row) for row in c.fetchall()]
         conn.close()
+        
+        school_conn = get_school_db_connection(user_data['school_number'] if SHARDED_MODE else None)
+        c = school_conn.cursor()
+        c.execute("SELECT COUNT(*) FROM equipment")
+        totals['equipment'] = c.fetchone()[0]
+        c.execute("SELECT COUNT(*) FROM requests")
+        totals['requests'] = c.fetchone()[0]
+        
+        c.execute('''SELECT * FROM equipment ORDER BY id DESC LIMIT ? OFFSET ?''', (DATABASES_PAGE_SIZE, offset))
+        equipment = [dict(row) for row in c.fetchall()]
+        
+        c.execute('''SELECT r.*, u.username as student_username, e.name as equipment_name 
+                     FROM requests r 
+                     LEFT JOIN users u ON r.student_id = u.id 
+                     LEFT JOIN equipment e ON r.equipment_id = e.id
+                     ORDER BY r.id DESC LIMIT ? OFFSET ?''', (DATABASES_PAGE_SIZE, offset))
+        requests = [dict(row) for row in c.fetchall()]
+        school_conn.close()
     except:
         pass
     
     unread_count = get_unread_notifications_count(session['user_id'])
     
+    total_rows = max(totals['users'], totals['equipment'], totals['requests'])
+    has_next = offset + DATABASES_PAGE_SIZE < total_rows
+    
     return render_template('databases.html', 
                          user=user_data,
+                         stats=dict(stats, totals=totals),
+                         page=page,
+                         has_next=has_next,
                          users=users,
                          equipment=equipment,
                          requests=requests,
                          logs=logs,
                          unread_count=unread_count)
 
+def build_export_query(table, school_number=None, date_from=None, date_to=None):
+    spec = EXPORT_TABLES[table]
+    conditions = []
+    params = []
+    if school_number:
+        conditions.append(f"{spec['school_column']} = ?")
+        params.append(school_number)
+    if date_from:
+        conditions.append(f"{spec['date_column']} >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{spec['date_column']} < date(?, '+1 day')")
+        params.append(date_to)
+    
+    query = spec['query']
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f" ORDER BY {spec['order_column']}"
+    return query, params
+
+def get_export_school_numbers(table, school_number):
+    if not EXPORT_TABLES[table].get('per_school'):
+        return [None]
+    if SHARDED_MODE and school_number:
+        return [school_number]
+    return school_shard_numbers()
+
+def iter_export_rows(query, params, export_format, school_numbers):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    
+    for school_number in school_numbers:
+        conn = get_school_db_connection(school_number)
+        try:
+            c = conn.cursor()
+            c.execute(query, params)
+            columns = [col[0] for col in c.description]
+            
+            if export_format == 'csv' and not header_written:
+                buffer.write('\ufeff')
+                writer.writerow(columns)
+                header_written = True
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+            
+            while True:
+                rows = c.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                if export_format == 'csv':
+                    writer.writerows(tuple(row) for row in rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+                else:
+                    yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+        finally:
+            conn.close()
+
+@app.route('/admin/export/<table>')
+def admin_export(table):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data or user_data['role'] != 'teacher':
+        return "Доступ запрещен", 403
+    
+    if table not in EXPORT_TABLES:
+        return "Неизвестная таблица", 404
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ['csv', 'ndjson']:
+        return "Поддерживаются форматы csv и ndjson", 400
+    
+    school_number = safe_input(request.args.get('school_number', '').strip().upper())
+    if school_number and not is_registered_school(school_number):
+        return "Школа не зарегистрирована", 400
+    
+    date_from = request.args.get('date_from', '').strip()
+    date_to = request.args.get('date_to', '').strip()
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return "Неверный формат даты. Используйте ГГГГ-ММ-ДД", 400
+    
+    query, params = build_export_query(table, school_number, date_from, date_to)
+    log_action(session['user_id'], f'EXPORT {table} as {export_format}')
+    
+    if export_format == 'csv':
+        mimetype = 'text/csv; charset=utf-8'
+    else:
+        mimetype = 'application/x-ndjson; charset=utf-8'
+    filename = f"{table}_{get_moscow_time().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    
+    school_numbers = get_export_school_numbers(table, school_number)
+    return Response(stream_with_context(iter_export_rows(query, params, export_format, school_numbers)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def validate_user_import_row(row, seen_usernames, seen_emails):
+    data = {field: safe_input((row.get(field) or '').strip().upper())
+            for field in ['first_name', 'last_name', 'middle_name', 'school_number', 'class', 'username']}
+    data['email'] = safe_input((row.get('email') or '').strip().lower())
+    data['password'] = (row.get('password') or '').strip()
+    data['role'] = (row.get('role') or 'student').strip().lower()
+    
+    missing = [field for field in ['first_name', 'last_name', 'school_number', 'class', 'username', 'email', 'password']
+               if not data[field]]
+    if missing:
+        return None, f"Не заполнены поля: {', '.join(missing)}"
+    if data['role'] not in ['student', 'teacher']:
+        return None, f"Неизвестная роль: {data['role']}"
+    if data['role'] not in IMPORT_USER_ROLES:
+        return None, 'Учетные записи учителей нельзя создавать импортом'
+    if not is_valid_school_number(data['school_number']):
+        return None, f"Некорректный номер школы: {data['school_number']}"
+    if data['username'] in seen_usernames or data['email'] in seen_emails:
+        return None, 'Логин или email повторяются в файле'
+    
+    seen_usernames.add(data['username'])
+    seen_emails.add(data['email'])
+    return (data['first_name'], data['last_name'], data['middle_name'], data['school_number'], data['class'],
+            data['username'], data['email'], data['password'], data['role']), None
+
+def validate_equipment_import_row(row, default_school_number, created_by):
+    name = safe_input((row.get('name') or '').strip()).upper()
+    description = safe_input((row.get('description') or '').strip())
+    category = safe_input((row.get('category') or 'technology').strip())
+    school_number = safe_input((row.get('school_number') or '').strip().upper()) or default_school_number
+    
+    if not name:
+        return None, 'Не указано название'
+    if not is_valid_school_number(school_number):
+        return None, f"Некорректный номер школы: {school_number}"
+    try:
+        available = int((row.get('available') or '1').strip())
+    except ValueError:
+        return None, 'Количество должно быть числом'
+    if available < 0:
+        return None, 'Количество не может быть отрицательным'
+    
+    return (name, description, category, school_number, available, created_by), None
+
+def insert_user_import_chunk(c, chunk):
+    placeholders = ','.join('?' * len(chunk))
+    c.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", [values[5] for _, values in chunk])
+    taken_usernames = {row['username'] for row in c.fetchall()}
+    c.execute(f"SELECT email FROM users WHERE email IN ({placeholders})", [values[6] for _, values in chunk])
+    taken_emails = {row['email'] for row in c.fetchall()}
+    
+    rows = []
+    errors = []
+    for line_number, values in chunk:
+        if values[5] in taken_usernames or values[6] in taken_emails:
+            errors.append({'line': line_number, 'error': 'Логин или email уже заняты'})
+        else:
+            rows.append(values)
+    
+    c.executemany('''INSERT INTO users
+                     (first_name, last_name, middle_name, school_number, class, username, email, password, role)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    for school_number in {values[3] for values in rows}:
+        register_school(c, school_number)
+    return len(rows), errors
+
+def insert_equipment_import_chunk(chunk):
+    school_numbers = list({values[3] for _, values in chunk})
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT school_number FROM school_shards WHERE school_number IN ({','.join('?' * len(school_numbers))})",
+              school_numbers)
+    known_schools = {row['school_number'] for row in c.fetchall()}
+    conn.close()
+    
+    errors = []
+    rows_by_school = {}
+    for line_number, values in chunk:
+        if values[3] in known_schools:
+            rows_by_school.setdefault(values[3], []).append(values)
+        else:
+            errors.append({'line': line_number, 'error': f"Школа не зарегистрирована: {values[3]}"})
+    inserted = sum(len(rows) for rows in rows_by_school.values())
+    
+    for school_number, rows in rows_by_school.items():
+        def operation(conn, school_number=school_number, rows=rows):
+            conn.executemany('''INSERT INTO equipment
+                                (name, description, category, school_number, available, created_by)
+                                VALUES (?, ?, ?, ?, ?, ?)''', rows)
+            bump_data_version(conn, catalog_version_name(school_number))
+        
+        run_write(operation, school_number)
+    return inserted, errors
+
+def update_import_job(c, job_id, errors=None, **fields):
+    if errors:
+        c.execute("SELECT errors FROM import_jobs WHERE id = ?", (job_id,))
+        stored_errors = json.loads(c.fetchone()['errors'])
+        stored_errors.extend(errors[:IMPORT_MAX_ERRORS - len(stored_errors)])
+        c.execute("UPDATE import_jobs SET errors = ?, error_count = error_count + ? WHERE id = ?",
+                  (json.dumps(stored_errors, ensure_ascii=False), len(errors), job_id))
+    if fields:
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        c.execute(f"UPDATE import_jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+def flush_import_chunk(kind, chunk, errors):
+    if kind == 'users':
+        inserted, chunk_errors = run_write(lambda conn: insert_user_import_chunk(conn.cursor(), chunk))
+    else:
+        inserted, chunk_errors = insert_equipment_import_chunk(chunk)
+    errors.extend(chunk_errors)
+    return inserted
+
+def save_import_progress(job_id, errors=None, **fields):
+    run_write(lambda conn: update_import_job(conn.cursor(), job_id, errors, **fields))
+
+def run_import_job(job_id, kind, path, admin_id, school_number):
+    seen_usernames = set()
+    seen_emails = set()
+    processed = 0
+    imported = 0
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            chunk = []
+            errors = []
+            for row in reader:
+                processed += 1
+                if kind == 'users':
+                    values, error = validate_user_import_row(row, seen_usernames, seen_emails)
+                else:
+                    values, error = validate_equipment_import_row(row, school_number, admin_id)
+                if error:
+                    errors.append({'line': reader.line_num, 'error': error})
+                else:
+                    chunk.append((reader.line_num, values))
+                
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    imported += flush_import_chunk(kind, chunk, errors)
+                    save_import_progress(job_id, errors, processed=processed, imported=imported)
+                    chunk = []
+                    errors = []
+            
+            if chunk:
+                imported += flush_import_chunk(kind, chunk, errors)
+            save_import_progress(job_id, errors, processed=processed, imported=imported,
+                                 status='done', finished_at=format_moscow_time())
+        
+        invalidate_dashboard_stats()
+        log_action(admin_id, f'BULK_IMPORT {kind}: {imported}')
+    except Exception as e:
+        try:
+            save_import_progress(job_id, status='failed', fatal_error=str(e),
+                                 finished_at=format_moscow_time())
+        except:
+            pass
+    finally:
+        os.remove(path)
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def admin_import(kind):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    user_data = get_user_by_id(session['user_id'])
+    if not user_data or user_data['role'] != 'teacher':
+        return jsonify({'success': False, 'error': 'Доступ запрещен'})
+    
+    if kind not in ['users', 'equipment']:
+        return jsonify({'success': False, 'error': 'Неизвестный тип импорта'})
+    
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'error': 'Выберите CSV файл'})
+    
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'wb') as f:
+        file.save(f)
+    
+    job_id = uuid.uuid4().hex
+    started_by = session['user_id']
+    
+    def operation(conn):
+        conn.execute('''INSERT INTO import_jobs (id, kind, started_by, started_at) VALUES (?, ?, ?, ?)''',
+                     (job_id, kind, started_by, format_moscow_time()))
+    
+    try:
+        run_write(operation)
+    except:
+        os.remove(path)
+        return jsonify({'success': False, 'error': 'Ошибка базы'})
+    
+    Thread(target=run_import_job,
+           args=(job_id, kind, path, session['user_id'], user_data['school_number']),
+           daemon=True).start()
+    
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/admin/import/status/<job_id>')
+def admin_import_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Не авторизован'})
+    
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("SELECT * FROM import_jobs WHERE id = ? AND started_by = ?", (job_id, session['user_id']))
+        job = c.fetchone()
+        conn.close()
+    except:
+        return jsonify({'success': False, 'error': 'Ошибка базы'})
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'Задача не найдена'})
+    
+    job = dict(job)
+    job['errors'] = json.loads(job['errors'])
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/update_profile', methods=['POST'])
 def update_profile():
     if 'user_id' not in session:
@@ -948,17 +2729,17 @@ def update_profile():
     if not all([first_name, last_name, email]):
         return 'Заполните все обязательные поля', 400
     
+    user_id = session['user_id']
+    
+    def operation(conn):
+        conn.execute('''UPDATE users 
+                        SET first_name = ?, last_name = ?, middle_name = ?, email = ?
+                        WHERE id = ?''',
+                     (first_name, last_name, middle_name, email, user_id))
+        log_action(user_id, 'UPDATE_PROFILE')
+    
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''UPDATE users 
-                    SET first_name = ?, last_name = ?, middle_name = ?, email = ?
-                    WHERE id = ?''',
-                 (first_name, last_name, middle_name, email, session['user_id']))
-        conn.commit()
-        conn.close()
-        
-        log_action(session['user_id'], 'UPDATE_PROFILE')
+        run_write(operation)
         return 'Профиль обновлен'
     except:
         return 'Ошибка обновления', 500
@@ -978,12 +2759,11 @@ def mark_notification_read_api():
     
     notification_id = request.json.get('notification_id')
     if notification_id:
+        def operation(conn):
+            conn.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notification_id,))
+        
         try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notification_id,))
-            conn.commit()
-            conn.close()
+            run_write(operation)
         except:
             pass
     
@@ -994,12 +2774,13 @@ def mark_all_notifications_read_api():
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Не авторизован'})
     
+    user_id = session['user_id']
+    
+    def operation(conn):
+        conn.execute("UPDATE notifications SET is_read = 1 WHERE user_id = ?", (user_id,))
+    
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("UPDATE notifications SET is_read = 1 WHERE user_id = ?", (session['user_id'],))
-        conn.commit()
-        conn.close()
+        run_write(operation)
         return jsonify({'success': True})
     except:
         return jsonify({'success': False, 'error': 'Ошибка'})
@@ -1017,6 +2798,5 @@ def internal_server_error(e):
     return render_template('500.html'), 500
 
 if __name__ == '__main__':
-    if not os.path.exists(MAIN_DB):
-        init_database()
+    init_database()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
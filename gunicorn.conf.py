@@ -0,0 +1,32 @@
+import os
+import multiprocessing
+import subprocess
+import sys
+
+bind = os.environ.get('SCHOOLTECH_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('SCHOOLTECH_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('SCHOOLTECH_THREADS', 4))
+worker_class = 'gthread'
+timeout = 60
+graceful_timeout = 30
+accesslog = '-'
+
+preload_app = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# application не импортируется в master: воркеры форкаются от него и унаследовали бы
+# его потоки и блокировки, поэтому инициализация и контрольные точки WAL идут в отдельных процессах
+def application_command(function_name):
+    return [sys.executable, '-c', f'import application; application.{function_name}()']
+
+def on_starting(server):
+    subprocess.run(application_command('init_database'), cwd=BASE_DIR, check=True)
+
+def when_ready(server):
+    server.wal_checkpointer = subprocess.Popen(application_command('run_wal_checkpointer'), cwd=BASE_DIR)
+
+def on_exit(server):
+    checkpointer = getattr(server, 'wal_checkpointer', None)
+    if checkpointer is not None and checkpointer.poll() is None:
+        checkpointer.terminate()
\ No newline at end of file
@@ -0,0 +1,44 @@
+import argparse
+import multiprocessing
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Запуск ШКОЛТЕХ в режиме production')
+    parser.add_argument('--server', choices=['gunicorn', 'waitress'],
+                        default='waitress' if sys.platform == 'win32' else 'gunicorn')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--write-queue', action='store_true',
+                        help='сериализовать запись через отдельный поток с групповым коммитом')
+    return parser.parse_args()
+
+def run_gunicorn(args):
+    os.environ['SCHOOLTECH_BIND'] = f'{args.host}:{args.port}'
+    os.environ['SCHOOLTECH_WORKERS'] = str(args.workers)
+    os.environ['SCHOOLTECH_THREADS'] = str(args.threads)
+    os.chdir(BASE_DIR)
+    os.execvp('gunicorn', ['gunicorn', '-c', os.path.join(BASE_DIR, 'gunicorn.conf.py'), 'wsgi:application'])
+
+def run_waitress(args):
+    from waitress import serve
+    from application import app, init_database, start_wal_checkpointer
+    
+    if args.workers > 1:
+        print('waitress работает в одном процессе, параметр --workers игнорируется')
+    init_database()
+    start_wal_checkpointer()
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.write_queue:
+        os.environ['SCHOOLTECH_WRITE_QUEUE'] = '1'
+    if args.server == 'gunicorn':
+        run_gunicorn(args)
+    else:
+        run_waitress(args)
\ No newline at end of file
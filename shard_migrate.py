@@ -0,0 +1,93 @@
+import argparse
+import os
+import sqlite3
+import sys
+
+import application
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Разделение базы ШКОЛТЕХ на файлы по школам')
+    parser.add_argument('--source', default=application.MAIN_DB)
+    parser.add_argument('--shards-dir', default=application.SHARDS_DIR)
+    parser.add_argument('--purge', action='store_true',
+                        help='удалить перенесенные записи из общей базы')
+    return parser.parse_args()
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def copy_rows(source, target, table, query, params):
+    columns = table_columns(target, table)
+    c = source.execute(query.format(columns=', '.join(f"{table}.{column}" for column in columns)), params)
+    placeholders = ', '.join('?' * len(columns))
+    insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    copied = 0
+    while True:
+        rows = c.fetchmany(application.EXPORT_CHUNK_SIZE)
+        if not rows:
+            break
+        target.executemany(insert, rows)
+        copied += len(rows)
+    return copied
+
+def missing_rows(source, target, table, query, params):
+    id_query = query.format(columns=f"{table}.id")
+    source_ids = {row[0] for row in source.execute(id_query, params)}
+    target_ids = {row[0] for row in target.execute(id_query, params)}
+    return len(source_ids), len(source_ids - target_ids)
+
+def migrate(source_path, purge):
+    # Схема общей базы приводится к текущей версии, чтобы столбцы совпадали с файлами школ
+    application.MAIN_DB = source_path
+    application.init_database()
+    
+    source = sqlite3.connect(source_path, timeout=application.DB_BUSY_TIMEOUT)
+    school_numbers = [row[0] for row in source.execute(
+        "SELECT DISTINCT school_number FROM equipment ORDER BY school_number")]
+    
+    migrated = []
+    for school_number in school_numbers:
+        try:
+            path = application.school_shard_path(school_number)
+        except ValueError as e:
+            print(f"Школа №{school_number} пропущена: {e}")
+            continue
+        application.init_school_database(path)
+        target = sqlite3.connect(path, timeout=application.DB_BUSY_TIMEOUT)
+        
+        equipment_query = "SELECT {columns} FROM equipment WHERE school_number = ?"
+        requests_query = '''SELECT {columns} FROM requests
+                            JOIN equipment ON requests.equipment_id = equipment.id
+                            WHERE equipment.school_number = ?'''
+        equipment_count = copy_rows(source, target, 'equipment', equipment_query, (school_number,))
+        request_count = copy_rows(source, target, 'requests', requests_query, (school_number,))
+        target.commit()
+        
+        # Перед удалением каждая запись общей базы должна найтись в файле школы
+        checks = [missing_rows(source, target, 'equipment', equipment_query, (school_number,)),
+                  missing_rows(source, target, 'requests', requests_query, (school_number,))]
+        target.close()
+        print(f"Школа №{school_number}: оборудование {equipment_count}, заявки {request_count} -> {path}")
+        
+        if (equipment_count, request_count) == tuple(total for total, _ in checks) and not any(missing for _, missing in checks):
+            migrated.append(school_number)
+        else:
+            print(f"Школа №{school_number}: перенесены не все записи, удаление из общей базы отменено")
+    
+    if purge:
+        for school_number in migrated:
+            source.execute('''DELETE FROM requests
+                              WHERE equipment_id IN (SELECT id FROM equipment WHERE school_number = ?)''',
+                           (school_number,))
+            source.execute("DELETE FROM equipment WHERE school_number = ?", (school_number,))
+        source.commit()
+        print(f"Перенесенные записи удалены из общей базы для школ: {', '.join(migrated) or 'нет'}")
+    source.close()
+    return len(migrated) == len(school_numbers)
+
+if __name__ == '__main__':
+    args = parse_args()
+    application.SHARDS_DIR = os.path.abspath(args.shards_dir)
+    if not migrate(os.path.abspath(args.source), args.purge):
+        sys.exit(1)
+    print("Готово. Запустите приложение с SCHOOLTECH_SHARDED=1")
\ No newline at end of file
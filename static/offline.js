@@ -0,0 +1,191 @@
+// ===== ЛОКАЛЬНЫЙ КЭШ (IndexedDB) И СИНХРОНИЗАЦИЯ ИЗМЕНЕНИЙ =====
+const SchoolTechCache = (function() {
+    const DB_NAME = 'schooltech';
+    const DB_VERSION = 1;
+    const STORES = ['equipment', 'chat_users', 'chat_messages', 'meta'];
+    const MAX_MESSAGES_PER_CHAT = 200;
+
+    let dbPromise = null;
+    let readyPromise = Promise.resolve();
+
+    function openDatabase() {
+        if (!('indexedDB' in window)) {
+            return Promise.resolve(null);
+        }
+        if (!dbPromise) {
+            dbPromise = new Promise(resolve => {
+                const request = indexedDB.open(DB_NAME, DB_VERSION);
+                request.onupgradeneeded = () => {
+                    const db = request.result;
+                    db.createObjectStore('equipment', { keyPath: 'id' });
+                    db.createObjectStore('chat_users', { keyPath: 'id' });
+                    const messages = db.createObjectStore('chat_messages', { keyPath: 'id' });
+                    messages.createIndex('chat', 'chat_id');
+                    db.createObjectStore('meta');
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => resolve(null);
+                request.onblocked = () => resolve(null);
+            });
+        }
+        return dbPromise;
+    }
+
+    // Выполняет work(store) в транзакции и ждет ее завершения
+    function withStore(storeName, mode, work) {
+        return openDatabase().then(db => {
+            if (!db) return null;
+            return new Promise((resolve, reject) => {
+                const transaction = db.transaction(storeName, mode);
+                let result = null;
+                const request = work(transaction.objectStore(storeName));
+                if (request) {
+                    request.onsuccess = () => { result = request.result; };
+                }
+                transaction.oncomplete = () => resolve(result);
+                transaction.onerror = () => reject(transaction.error);
+                transaction.onabort = () => reject(transaction.error);
+            });
+        });
+    }
+
+    function getAll(storeName) {
+        return withStore(storeName, 'readonly', store => store.getAll()).then(items => items || []);
+    }
+
+    function getAllByIndex(storeName, indexName, key) {
+        return withStore(storeName, 'readonly', store => store.index(indexName).getAll(key)).then(items => items || []);
+    }
+
+    function putAll(storeName, items) {
+        if (!items.length) return Promise.resolve();
+        return withStore(storeName, 'readwrite', store => {
+            items.forEach(item => store.put(item));
+        });
+    }
+
+    function deleteKeys(storeName, keys) {
+        if (!keys.length) return Promise.resolve();
+        return withStore(storeName, 'readwrite', store => {
+            keys.forEach(key => store.delete(key));
+        });
+    }
+
+    function clearStore(storeName) {
+        return withStore(storeName, 'readwrite', store => store.clear());
+    }
+
+    function getMeta(key) {
+        return withStore('meta', 'readonly', store => store.get(key));
+    }
+
+    function setMeta(key, value) {
+        return withStore('meta', 'readwrite', store => store.put(value, key));
+    }
+
+    // На общих школьных компьютерах кэш принадлежит только одному пользователю
+    function init(userId) {
+        readyPromise = getMeta('owner').then(owner => {
+            if (owner === userId) return null;
+            return Promise.all(STORES.map(clearStore)).then(() => setMeta('owner', userId));
+        }).catch(error => {
+            console.error('Ошибка инициализации кэша:', error);
+        });
+
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js').catch(error => {
+                console.error('Ошибка регистрации service worker:', error);
+            });
+        }
+        return readyPromise;
+    }
+
+    function fetchJSON(url) {
+        return fetch(url).then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ошибка: ${response.status}`);
+            }
+            return response.json();
+        }).then(data => {
+            if (!data.success) {
+                throw new Error(data.error || 'Неизвестная ошибка');
+            }
+            return data;
+        });
+    }
+
+    // Показывает данные из кэша, затем запрашивает только изменения с сохраненной версии.
+    // Версия имеет смысл только вместе с номером файла базы, из которого она получена
+    function loadCollection(storeName, url, render, renderCached = true) {
+        const versionKey = storeName + '_version';
+        const databaseKey = storeName + '_database';
+        let cachedVersion = 0;
+        let cachedDatabase = 0;
+
+        return readyPromise
+            .then(() => Promise.all([getAll(storeName), getMeta(versionKey), getMeta(databaseKey)]))
+            .then(([items, version, database]) => {
+                cachedVersion = version || 0;
+                cachedDatabase = database || 0;
+                if (renderCached && items.length) {
+                    render(items);
+                }
+                return fetchJSON(`${url}?since=${cachedVersion}&database=${cachedDatabase}`);
+            })
+            .then(data => {
+                const changed = data.full || data.changed.length > 0 || data.removed.length > 0;
+                return (data.full ? clearStore(storeName) : Promise.resolve())
+                    .then(() => deleteKeys(storeName, data.removed))
+                    .then(() => putAll(storeName, data.changed))
+                    .then(() => setMeta(versionKey, data.version))
+                    .then(() => setMeta(databaseKey, data.database))
+                    .then(() => openDatabase())
+                    .then(db => {
+                        if (!changed) return;
+                        if (!db) {
+                            render(data.changed);
+                            return;
+                        }
+                        return getAll(storeName).then(render);
+                    });
+            });
+    }
+
+    function sortMessages(messages) {
+        return messages.sort((a, b) => a.id - b.id).slice(-MAX_MESSAGES_PER_CHAT);
+    }
+
+    // История переписки: из кэша сразу, с сервера только сообщения новее последнего известного
+    function loadChatMessages(chatId, render) {
+        let cached = [];
+
+        return readyPromise
+            .then(() => getAllByIndex('chat_messages', 'chat', chatId))
+            .then(messages => {
+                cached = sortMessages(messages);
+                render(cached);
+                const lastId = cached.length ? cached[cached.length - 1].id : 0;
+                return fetchJSON(`/chat/messages/${chatId}?after=${lastId}`);
+            })
+            .then(data => {
+                if (!data.messages.length) return;
+                // Относительная подпись времени ("Вчера 10:15") в кэше устаревает, храним только created_at
+                const fresh = data.messages.map(message => {
+                    const cachedMessage = Object.assign({ chat_id: chatId }, message);
+                    delete cachedMessage.created_at_formatted;
+                    return cachedMessage;
+                });
+                const all = sortMessages(cached.concat(fresh));
+                const keep = new Set(all.map(message => message.id));
+                const stale = cached.filter(message => !keep.has(message.id)).map(message => message.id);
+                render(all);
+                return putAll('chat_messages', fresh).then(() => deleteKeys('chat_messages', stale));
+            });
+    }
+
+    return {
+        init: init,
+        loadCollection: loadCollection,
+        loadChatMessages: loadChatMessages
+    };
+})();
\ No newline at end of file
@@ -219,7 +219,136 @@ function requestEquipment(equipmentId) {
     });
 }
 
+// ===== СИНХРОНИЗАЦИЯ КАТАЛОГА =====
+function updateEquipmentCard(item) {
+    const card = document.querySelector(`.equipment-card[data-equipment-id="${item.id}"]`);
+    if (!card) return;
+    
+    const available = item.available || 0;
+    const counter = card.querySelector('.equipment-available');
+    if (counter) {
+        counter.textContent = `Доступно: ${available} шт.`;
+    }
+    
+    const overlay = card.querySelector('.unavailable-overlay');
+    if (available === 0 && !overlay) {
+        card.querySelector('.equipment-image').insertAdjacentHTML('afterend', `
+            <div class="unavailable-overlay">
+                <div class="unavailable-text">Нет в наличии</div>
+            </div>
+        `);
+    } else if (available !== 0 && overlay) {
+        overlay.remove();
+    }
+    
+    const button = card.querySelector('.order-button');
+    if (button) {
+        button.disabled = available <= 0;
+        button.classList.toggle('disabled', available <= 0);
+        button.textContent = available > 0 ? 'ПОДАТЬ ЗАЯВКУ' : 'НЕТ В НАЛИЧИИ';
+        button.onclick = available > 0 ? () => requestEquipment(item.id) : null;
+    }
+}
+
+// Запрашивает только изменившееся оборудование и обновляет карточки на месте
+function syncEquipmentCatalog() {
+    if (typeof SchoolTechCache === 'undefined' || !document.querySelector('.equipment-grid')) return;
+    
+    SchoolTechCache.loadCollection('equipment', '/equipment/changes', items => {
+        items.forEach(updateEquipmentCard);
+    }, false).catch(error => {
+        console.error('Ошибка синхронизации каталога:', error);
+    });
+}
+
 // ===== ФУНКЦИИ ДЛЯ УЧИТЕЛЯ =====
+let teacherRequestsVersion = 0;
+let teacherRequestsDatabase = 0;
+
+function renderTeacherRequest(request) {
+    let actionsHTML = '';
+    const canApprove = request.status === 'pending' && request.equipment_available > 0;
+    
+    if (request.status === 'pending') {
+        actionsHTML = `
+            <div class="teacher-actions">
+                <button class="action-btn btn-approve" 
+                        onclick="approveRequest(${request.id})"
+                        ${!canApprove ? 'disabled title="Оборудование недоступно"' : ''}>
+                    ОДОБРИТЬ
+                </button>
+                <button class="action-btn btn-reject" 
+                        onclick="rejectRequest(${request.id})">
+                    ОТКЛОНИТЬ
+                </button>
+            </div>
+        `;
+    } else if (request.status === 'approved') {
+        actionsHTML = `
+            <div class="teacher-actions">
+                <button class="action-btn btn-return" 
+                        onclick="returnRequest(${request.id})">
+                    ОТМЕТИТЬ ВОЗВРАТ
+                </button>
+            </div>
+        `;
+    }
+    
+    const item = document.createElement('div');
+    item.className = 'request-item';
+    item.dataset.requestId = request.id;
+    item.innerHTML = `
+        <div class="request-header">
+            <h3>${request.equipment_name || 'Неизвестное оборудование'}</h3>
+            <span class="request-status status-${request.status || 'pending'}">
+                ${getStatusText(request.status)}
+            </span>
+        </div>
+        <p><strong>Ученик:</strong> ${request.student_name || 'Неизвестный'}</p>
+        <p><strong>Класс:</strong> ${request.student_class || 'Не указан'}</p>
+        <p><strong>Дата заявки:</strong> ${request.request_date || 'Не указана'}</p>
+        ${request.is_reservation ? `<p><strong>Бронь:</strong> ${request.start_at.slice(0, 16)} — ${request.end_at.slice(0, 16)}</p>` : ''}
+        ${request.due_date ? `<p><strong>Вернуть до:</strong> ${request.due_date}</p>` : ''}
+        ${request.status === 'pending' ? `<p><strong>Доступно единиц:</strong> ${request.equipment_available || 0}</p>` : ''}
+        ${actionsHTML}
+    `;
+    return item;
+}
+
+function applyTeacherRequestChanges(container, data) {
+    if (data.full) {
+        container.innerHTML = '';
+    }
+    
+    const placeholder = container.querySelector('.no-requests, .loading, .error');
+    if (placeholder) {
+        placeholder.remove();
+    }
+    
+    data.removed.forEach(requestId => {
+        const item = container.querySelector(`[data-request-id="${requestId}"]`);
+        if (item) {
+            item.remove();
+        }
+    });
+    
+    data.changed.forEach(request => {
+        const item = renderTeacherRequest(request);
+        const existing = container.querySelector(`[data-request-id="${request.id}"]`);
+        if (existing) {
+            existing.replaceWith(item);
+            return;
+        }
+        // Заявки отсортированы от новых к старым, id растет вместе с датой
+        const next = Array.from(container.children).find(child => Number(child.dataset.requestId) < request.id);
+        container.insertBefore(item, next || null);
+    });
+    
+    if (!container.querySelector('.request-item')) {
+        container.innerHTML = '<div class="no-requests">Нет активных заявок от учеников</div>';
+    }
+}
+
 function loadTeacherRequests() {
     console.log('=== ЗАГРУЗКА ЗАЯВОК УЧИТЕЛЯ ===');
     const container = document.getElementById('teacher-requests-list');
@@ -228,9 +357,12 @@ function loadTeacherRequests() {
         return;
     }
 
-    container.innerHTML = '<div class="loading">Загрузка заявок...</div>';
+    if (!teacherRequestsVersion) {
+        container.innerHTML = '<div class="loading">Загрузка заявок...</div>';
+    }
 
-    fetch('/teacher_requests')
+    // Запрашиваем только заявки, изменившиеся после полученной версии
+    fetch(`/teacher_requests/changes?since=${teacherRequestsVersion}&database=${teacherRequestsDatabase}`)
     .then(response => {
         if (!response.ok) {
             throw new Error(`HTTP ошибка: ${response.status}`);
@@ -238,65 +370,18 @@ function loadTeacherRequests() {
         return response.json();
     })
     .then(data => {
-        console.log('Получены заявки:', data);
+        console.log('Получены изменения заявок:', data);
         
-        if (data.success && data.requests && data.requests.length > 0) {
-            let html = '';
-            data.requests.forEach(request => {
-                console.log('Обработка заявки:', request);
-                
-                let actionsHTML = '';
-                const canApprove = request.status === 'pending' && request.equipment_available > 0;
-                
-                if (request.status === 'pending') {
-                    actionsHTML = `
-                        <div class="teacher-actions">
-                            <button class="action-btn btn-approve" 
-                                    onclick="approveRequest(${request.id})"
-                                    ${!canApprove ? 'disabled title="Оборудование недоступно"' : ''}>
-                                ОДОБРИТЬ
-                            </button>
-                            <button class="action-btn btn-reject" 
-                                    onclick="rejectRequest(${request.id})">
-                                ОТКЛОНИТЬ
-                            </button>
-                        </div>
-                    `;
-                } else if (request.status === 'approved') {
-                    actionsHTML = `
-                        <div class="teacher-actions">
-                            <button class="action-btn btn-return" 
-                                    onclick="returnRequest(${request.id})">
-                                ОТМЕТИТЬ ВОЗВРАТ
-                            </button>
-                        </div>
-                    `;
-                }
-                
-                html += `
-                    <div class="request-item">
-                        <div class="request-header">
-                            <h3>${request.equipment_name || 'Неизвестное оборудование'}</h3>
-                            <span class="request-status status-${request.status || 'pending'}">
-                                ${getStatusText(request.status)}
-                            </span>
-                        </div>
-                        <p><strong>Ученик:</strong> ${request.student_name || 'Неизвестный'}</p>
-                        <p><strong>Класс:</strong> ${request.student_class || 'Не указан'}</p>
-                        <p><strong>Дата заявки:</strong> ${request.request_date || 'Не указана'}</p>
-                        ${request.due_date ? `<p><strong>Вернуть до:</strong> ${request.due_date}</p>` : ''}
-                        ${request.status === 'pending' ? `<p><strong>Доступно единиц:</strong> ${request.equipment_available || 0}</p>` : ''}
-                        ${actionsHTML}
-                    </div>
-                `;
-            });
-            container.innerHTML = html;
-        } else {
-            container.innerHTML = '<div class="no-requests">Нет активных заявок от учеников</div>';
+        if (!data.success) {
+            throw new Error(data.error || 'Неизвестная ошибка');
         }
+        applyTeacherRequestChanges(container, data);
+        teacherRequestsVersion = data.version;
+        teacherRequestsDatabase = data.database;
     })
     .catch(error => {
         console.error('Ошибка загрузки заявок:', error);
+        teacherRequestsVersion = 0;
         container.innerHTML = '<div class="error">Ошибка загрузки заявок. Попробуйте обновить страницу.</div>';
     });
 }
@@ -451,6 +536,7 @@ function updateRequestStatus(requestId, status, dueDate = null) {
             alert('Статус заявки успешно обновлен!');
             // Обновляем список заявок
             loadTeacherRequests();
+            syncEquipmentCatalog();
         } else {
             alert(`Ошибка: ${data.error || 'Неизвестная ошибка'}`);
             if (button) {
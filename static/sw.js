@@ -0,0 +1,55 @@
+// Service worker ШКОЛТЕХ: статические файлы отдаются из кэша и обновляются в фоне.
+// HTML-страницы и API не кэшируются: данные пользователей хранятся в IndexedDB (offline.js).
+const CACHE_NAME = 'schooltech-static-v1';
+const PRECACHE_URLS = [
+    '/static/style.css',
+    '/static/script.js',
+    '/static/offline.js',
+    '/static/images/placeholder.jpg',
+    '/static/images/favicon.ico'
+];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (request.method !== 'GET' || url.origin !== self.location.origin || !url.pathname.startsWith('/static/')) {
+        return;
+    }
+
+    event.respondWith(
+        caches.open(CACHE_NAME).then(cache =>
+            cache.match(request).then(cached => {
+                const network = fetch(request).then(response => {
+                    if (response.ok) {
+                        cache.put(request, response.clone());
+                    }
+                    return response;
+                });
+                if (cached) {
+                    event.waitUntil(network.catch(() => null));
+                    return cached;
+                }
+                return network;
+            })
+        )
+    );
+});
\ No newline at end of file
@@ -0,0 +1,3 @@
+from application import app
+
+application = app
\ No newline at end of file